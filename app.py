@@ -4,19 +4,28 @@ import re
 import sys
 import requests
 import base64
+import codecs
+import itertools
+import hashlib
+import json
+import tempfile
+import sqlite3
+import threading
+import uuid
 from io import StringIO, BytesIO
 from functools import partial
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Optional
+from contextlib import contextmanager
+from html.parser import HTMLParser
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 from PIL import Image
-from urllib.parse import quote_plus
-from bs4 import BeautifulSoup
-import google.generativeai as genai
-from audio_recorder_streamlit import audio_recorder
-import speech_recognition as sr
-import boto3
-from botocore.exceptions import BotoCoreError, ClientError
-from huggingface_hub import InferenceClient
+import numpy as np
+from urllib.parse import quote_plus, urlsplit, urlunsplit, parse_qsl, urlencode
 import random
+import time
 from datetime import datetime
 
 # Set page configuration FIRST - must be before any other Streamlit commands
@@ -57,10 +66,10 @@ if "auto_play_tts" not in st.session_state:
     st.session_state.auto_play_tts = False
 if "selected_voice" not in st.session_state:
     st.session_state.selected_voice = "Joanna"
-if "tts_audio" not in st.session_state:
-    st.session_state.tts_audio = {}
 if "last_audio" not in st.session_state:
     st.session_state.last_audio = None
+if "tts_autoplayed" not in st.session_state:
+    st.session_state.tts_autoplayed = None
 if "image_generator_mode" not in st.session_state:
     st.session_state.image_generator_mode = False
 if "polly_error" not in st.session_state:
@@ -75,6 +84,16 @@ if "image_history" not in st.session_state:
     st.session_state.image_history = []
 if "show_image_history" not in st.session_state:
     st.session_state.show_image_history = False
+if "context_summary" not in st.session_state:
+    st.session_state.context_summary = {"text": "", "covered": 0}
+if "stream_stats" not in st.session_state:
+    st.session_state.stream_stats = None
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+if "recent_image_results" not in st.session_state:
+    st.session_state.recent_image_results = []
+if "image_seed_value" not in st.session_state:
+    st.session_state.image_seed_value = 42
 
 # Random image generation prompts
 RANDOM_PROMPTS = [
@@ -105,20 +124,332 @@ RANDOM_PROMPTS = [
     "A mystical waterfall cascading into a glowing pool"
 ]
 
-# Web search function with caching
-@st.cache_data(ttl=3600)  # Cache for 1 hour
-def web_search(query, num_results=3):
+# Shared HTTP client - keep-alive connection pools per host, retries and size caps
+class HttpClient:
+    """Process-wide requests session for web search and page fetches"""
+
+    def __init__(self, pool_hosts, pool_size, max_retries):
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=0.3,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            respect_retry_after_header=False
+        )
+        self.adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.session.headers.update({'User-Agent': HTTP_USER_AGENT})
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.bytes_read = 0
+        self.truncated = 0
+
+    @contextmanager
+    def stream(self, url, timeout=5, max_bytes=None, headers=None):
+        """Open a streaming GET; yields (response, chunks) where chunks stop at max_bytes"""
+        with self.lock:
+            self.requests += 1
+        try:
+            response = self.session.get(url, headers=headers, timeout=timeout, stream=True)
+        except Exception:
+            with self.lock:
+                self.errors += 1
+            raise
+
+        try:
+            yield response, self._read_chunks(response, max_bytes or HTTP_MAX_RESPONSE_BYTES)
+        finally:
+            response.close()
+
+    def _read_chunks(self, response, max_bytes):
+        """Yield body chunks until max_bytes, counting what was read"""
+        size = 0
+        for chunk in response.iter_content(chunk_size=16384):
+            if size + len(chunk) > max_bytes:
+                chunk = chunk[:max_bytes - size]
+                with self.lock:
+                    self.truncated += 1
+            size += len(chunk)
+            with self.lock:
+                self.bytes_read += len(chunk)
+            if chunk:
+                yield chunk
+            if size >= max_bytes:
+                break
+
+    def get(self, url, timeout=5, max_bytes=None, headers=None):
+        """GET a URL and return (response, body) with the body cut off at max_bytes"""
+        with self.stream(url, timeout=timeout, max_bytes=max_bytes, headers=headers) as (response, chunks):
+            return response, b"".join(chunks)
+
+    def get_text(self, url, timeout=5, max_bytes=None, headers=None):
+        """GET a URL and return (response, decoded text)"""
+        response, body = self.get(url, timeout=timeout, max_bytes=max_bytes, headers=headers)
+        return response, body.decode(response.encoding or 'utf-8', errors='replace')
+
+    def stats(self):
+        """Request counters plus connection pool usage (reused = requests - new connections)"""
+        pools = self.adapter.poolmanager.pools
+        connections = 0
+        pool_requests = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                pool_requests += pool.num_requests
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "bytes": self.bytes_read,
+            "truncated": self.truncated,
+            "hosts": len(pools),
+            "connections": connections,
+            "reused": max(pool_requests - connections, 0)
+        }
+
+@st.cache_resource
+def get_http_client():
+    return HttpClient(HTTP_POOL_HOSTS, HTTP_POOL_SIZE, HTTP_MAX_RETRIES)
+
+# Thread-safe in-memory LRU cache shared through st.cache_resource
+class MemoryLRUCache:
+    """Bounded dict that evicts the least recently used entry"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+# SQLite table shared by every worker process using the same cache directory
+class SQLiteCacheStore:
+    """Persist JSON values with their freshness times, one connection per thread"""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.writes = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connection() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cache (namespace TEXT, key TEXT, value TEXT, "
+                "fresh_until REAL, stale_until REAL, PRIMARY KEY (namespace, key))"
+            )
+
+    def _connection(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL")  # Readers don't block the writer
+            self.local.db = db
+        return db
+
+    def get(self, namespace, key):
+        row = self._connection().execute(
+            "SELECT value, fresh_until, stale_until FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"value": json.loads(row[0]), "fresh_until": row[1], "stale_until": row[2]}
+
+    def put(self, namespace, key, entry):
+        with self._connection() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+                (namespace, key, json.dumps(entry["value"]), entry["fresh_until"], entry["stale_until"])
+            )
+            self.writes += 1
+            # Expired rows are kept a while for their validators, then pruned
+            if self.writes % 100 == 0:
+                db.execute("DELETE FROM cache WHERE stale_until < ?", (time.time() - WEB_CACHE_RETAIN_SECONDS,))
+
+# Single-flight: concurrent calls for the same key share one execution
+class SingleFlight:
+    """Run fn once per key at a time; callers arriving while it runs wait for its result"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def in_flight(self, key):
+        with self.lock:
+            return key in self.calls
+
+    def do(self, key, fn):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                del self.calls[key]
+        return future.result()
+
+# Two-level cache: in-memory LRU in front of an optional shared store
+class TieredCache:
+    """Entries are fresh until their TTL, then served stale while a background refresh
+    runs, until the stale window ends. Failures get their own (short) TTL and no stale window.
+    Concurrent loads of the same key are coalesced into one upstream call."""
+
+    def __init__(self, namespace, max_entries, store=None):
+        self.namespace = namespace
+        self.memory = MemoryLRUCache(max_entries)
+        self.store = store
+        self.lock = threading.Lock()
+        self.loads = SingleFlight()
+        self.counts = {"memory_hits": 0, "store_hits": 0, "stale_hits": 0, "misses": 0}
+
+    def _count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def lookup(self, key):
+        """Return (entry, state) with state "fresh", "stale", "expired" or "miss"
+        (expired entries are still returned so their contents can be revalidated)"""
+        now = time.time()
+        entry = self.memory.get(key)
+        tier = "memory_hits"
+        # Another process may have a newer copy than this one's memory
+        if self.store and (entry is None or entry["fresh_until"] <= now):
+            try:
+                stored = self.store.get(self.namespace, key)
+            except sqlite3.Error as e:
+                print(f"Cache store read failed: {str(e)}")
+                stored = None
+            if stored and (entry is None or stored["fresh_until"] > entry["fresh_until"]):
+                entry = stored
+                tier = "store_hits"
+                self.memory.put(key, entry)
+
+        if entry is None:
+            self._count("misses")
+            return None, "miss"
+        if entry["fresh_until"] > now:
+            self._count(tier)
+            return entry, "fresh"
+        if entry["stale_until"] > now:
+            self._count("stale_hits")
+            return entry, "stale"
+        self._count("misses")
+        return entry, "expired"
+
+    def put(self, key, value, ttl, stale_seconds=0):
+        now = time.time()
+        entry = {"value": value, "fresh_until": now + ttl, "stale_until": now + ttl + stale_seconds}
+        self.memory.put(key, entry)
+        if self.store:
+            try:
+                self.store.put(self.namespace, key, entry)
+            except sqlite3.Error as e:
+                print(f"Cache store write failed: {str(e)}")
+
+    def get_or_load(self, key, loader, ttl, stale_seconds, negative_ttl, is_negative):
+        """Return the cached value or call loader(previous_value_or_None) and cache its result"""
+        entry, state = self.lookup(key)
+        if state == "fresh":
+            return entry["value"]
+        if state == "stale":
+            self._refresh_in_background(key, entry["value"], loader, ttl, stale_seconds, negative_ttl, is_negative)
+            return entry["value"]
+        return self._load(key, entry["value"] if entry else None, loader, ttl, stale_seconds, negative_ttl, is_negative)
+
+    def _load(self, key, previous, loader, ttl, stale_seconds, negative_ttl, is_negative):
+        def load():
+            value = loader(previous)
+            if is_negative(value):
+                self.put(key, value, negative_ttl)
+            else:
+                self.put(key, value, ttl, stale_seconds)
+            return value
+
+        return self.loads.do(key, load)
+
+    def _refresh_in_background(self, key, previous, loader, ttl, stale_seconds, negative_ttl, is_negative):
+        if self.loads.in_flight(key):
+            return
+        get_fetch_executor().submit(self._load, key, previous, loader, ttl, stale_seconds, negative_ttl, is_negative)
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.counts)
+        hits = counts["memory_hits"] + counts["store_hits"] + counts["stale_hits"]
+        lookups = hits + counts["misses"]
+        return {
+            **counts,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "entries": len(self.memory),
+            "upstream_calls": self.loads.executed,
+            "coalesced": self.loads.coalesced
+        }
+
+# Shared SQLite store for the web caches (None keeps them in memory only)
+@st.cache_resource
+def get_web_cache_store():
+    if WEB_CACHE_BACKEND != "sqlite":
+        return None
+    try:
+        return SQLiteCacheStore(os.path.join(CACHE_DIR, "web_cache.sqlite3"))
+    except (OSError, sqlite3.Error) as e:
+        print(f"Web cache store unavailable, using memory only: {str(e)}")
+        return None
+
+# One tiered cache per kind of web result ("search", "page")
+@st.cache_resource
+def get_web_cache(namespace):
+    return TieredCache(namespace, WEB_CACHE_MEMORY_ENTRIES, get_web_cache_store())
+
+# Page revalidation counters
+@st.cache_resource
+def get_page_cache_stats():
+    return {"revalidated": 0, "fetched": 0}
+
+# Search DuckDuckGo and parse the result list
+def search_duckduckgo(query, num_results=3):
     """Search the web and return results"""
     try:
+        from bs4 import BeautifulSoup
+
         # Use DuckDuckGo's HTML search (no API key needed)
         url = f"https://html.duckduckgo.com/html/?q={quote_plus(query)}"
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=5)  # Reduced timeout
+        response, html = get_http_client().get_text(url, timeout=5)  # Reduced timeout
 
         if response.status_code == 200:
-            soup = BeautifulSoup(response.text, 'html.parser')
+            soup = BeautifulSoup(html, 'html.parser')
             results = []
 
             for result in soup.find_all('div', class_='result')[:num_results]:
@@ -140,33 +471,602 @@ def web_search(query, num_results=3):
     except Exception as e:
         return [{"error": str(e)}]
 
-# Fetch webpage content with caching
-@st.cache_data(ttl=1800)  # Cache for 30 minutes
-def fetch_webpage(url):
-    """Fetch and extract text from a webpage"""
+# Web search function with caching - empty and failed searches are only cached briefly
+def web_search(query, num_results=3):
+    """Search the web and return results"""
+    cache_key = f"{num_results}:{' '.join(query.lower().split())}"
+    return get_web_cache("search").get_or_load(
+        cache_key,
+        lambda previous: search_duckduckgo(query, num_results),
+        ttl=SEARCH_CACHE_TTL,
+        stale_seconds=SEARCH_STALE_SECONDS,
+        negative_ttl=WEB_NEGATIVE_CACHE_TTL,
+        is_negative=lambda results: not results or "error" in results[0]
+    )
+
+# Parser target that turns HTML into blocks of visible text
+class PageTextCollector:
+    """Collect visible text split at block-level tags (skipping scripts and styles),
+    and report when enough text has been seen to stop parsing.
+
+    Each block records its tag, how much of it is link text and whether it sits
+    inside navigation/boilerplate, so the main content can be scored afterwards."""
+
+    BLOCK_TAGS = {
+        "html", "body", "title", "div", "p", "section", "article", "main", "header", "footer",
+        "nav", "aside", "ul", "ol", "li", "dl", "dt", "dd", "table", "tr", "td", "th",
+        "h1", "h2", "h3", "h4", "h5", "h6", "pre", "blockquote", "figcaption", "form", "br", "hr"
+    }
+    SKIP_TAGS = {"script", "style", "noscript", "template", "svg"}
+    VOID_TAGS = {"br", "hr", "img", "input", "meta", "link", "area", "base", "col", "embed", "source", "track", "wbr"}
+    BOILERPLATE_TAGS = {"nav", "header", "footer", "aside", "form"}
+    # Page-level containers: their class/id describes the layout ("has-sidebar"), not their content
+    CONTENT_TAGS = {"html", "body", "main", "article"}
+    # Whole words in class/id/role (split on whitespace, "-" and "_") that mark boilerplate
+    BOILERPLATE_WORDS = {
+        "nav", "navbar", "navigation", "menu", "footer", "header", "sidebar", "cookie", "cookies",
+        "consent", "banner", "breadcrumb", "breadcrumbs", "share", "sharing", "social", "comment",
+        "comments", "promo", "advert", "advertisement", "ads", "sponsor", "sponsored", "popup",
+        "modal", "newsletter", "subscribe", "related", "signup", "login"
+    }
+
+    def __init__(self, max_chars=None):
+        self.max_chars = max_chars
+        self.blocks = []
+        self.buffer = []
+        self.link_chars = 0
+        self.stack = []  # (tag, True/False when the element decides boilerplate, else None) for open elements
+        self.skip_depth = 0
+        self.link_depth = 0
+        self.char_count = 0
+
+    @property
+    def done(self):
+        return self.max_chars is not None and self.char_count >= self.max_chars
+
+    def start(self, tag, attrs=None):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+            return
+        if tag in self.BLOCK_TAGS:
+            self.flush()
+        if tag == "a":
+            self.link_depth += 1
+        if tag not in self.VOID_TAGS:
+            attrs = attrs or {}
+            if tag in self.CONTENT_TAGS:
+                boilerplate = False
+            elif tag in self.BOILERPLATE_TAGS:
+                boilerplate = True
+            else:
+                hint = f"{attrs.get('class') or ''} {attrs.get('id') or ''} {attrs.get('role') or ''}"
+                boilerplate = True if self.BOILERPLATE_WORDS.intersection(re.split(r"[\s_-]+", hint.lower())) else None
+            self.stack.append((tag, boilerplate))
+
+    def end(self, tag):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth = max(self.skip_depth - 1, 0)
+            return
+        if tag in self.BLOCK_TAGS:
+            self.flush()
+        if tag == "a":
+            self.link_depth = max(self.link_depth - 1, 0)
+        # Pop back to the matching open tag (tolerates unclosed <p>/<li>)
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i][0] == tag:
+                del self.stack[i:]
+                break
+
+    def data(self, text):
+        if not self.skip_depth:
+            self.buffer.append(text)
+            if self.link_depth:
+                self.link_chars += len(text.strip())
+
+    def flush(self):
+        """Close the current block, collapsing whitespace"""
+        text = " ".join("".join(self.buffer).split())
+        if text:
+            block_tag = next((tag for tag, _ in reversed(self.stack) if tag in self.BLOCK_TAGS), "body")
+            self.blocks.append({
+                "text": text,
+                "tag": block_tag,
+                "link_chars": min(self.link_chars, len(text)),
+                # The nearest landmark decides - a <nav> inside <main> is boilerplate, an <article> inside a sidebar wrapper isn't
+                "boilerplate": next((flag for _, flag in reversed(self.stack) if flag is not None), False)
+            })
+            self.char_count += len(text) + 1
+        self.buffer = []
+        self.link_chars = 0
+
+    def close(self):
+        self.flush()
+        return self
+
+    def text(self):
+        return " ".join(block["text"] for block in self.blocks)
+
+# Standard library fallback that drives a PageTextCollector like lxml's parser target
+class _StdlibHTMLFeeder(HTMLParser):
+    def __init__(self, collector):
+        super().__init__(convert_charrefs=True)
+        self.collector = collector
+
+    def handle_starttag(self, tag, attrs):
+        self.collector.start(tag, dict(attrs))
+
+    def handle_startendtag(self, tag, attrs):
+        self.collector.start(tag, dict(attrs))
+        self.collector.end(tag)
+
+    def handle_endtag(self, tag):
+        self.collector.end(tag)
+
+    def handle_data(self, data):
+        self.collector.data(data)
+
+# Charset declared in the Content-Type header, if any
+def response_charset(response):
+    """Return the explicit charset of a response, or None to let the parser detect it"""
+    if "charset=" in response.headers.get("Content-Type", "").lower():
+        return response.encoding
+    return None
+
+# Parse HTML incrementally from a stream of byte chunks
+def parse_html_stream(chunks, encoding, collector):
+    """Feed chunks to lxml (if installed) or html.parser until the collector has enough text"""
+    try:
+        from lxml import etree
+    except ImportError:
+        etree = None
+
+    # Without a header charset, look for a <meta charset> in the first chunk (default UTF-8)
+    chunks = iter(chunks)
+    first_chunk = next(chunks, b"")
+    if not encoding:
+        match = re.search(rb'<meta[^>]+charset=["\']?([\w-]+)', first_chunk[:4096], re.IGNORECASE)
+        encoding = match.group(1).decode('ascii') if match else 'utf-8'
+        try:
+            codecs.lookup(encoding)
+        except LookupError:
+            encoding = 'utf-8'
+    chunks = itertools.chain([first_chunk], chunks)
+
+    if etree is not None:
+        parser = etree.HTMLParser(target=collector, encoding=encoding)
+        for chunk in chunks:
+            parser.feed(chunk)
+            if collector.done:
+                break
+        else:
+            parser.close()
+    else:
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        parser = _StdlibHTMLFeeder(collector)
+        for chunk in chunks:
+            parser.feed(decoder.decode(chunk))
+            if collector.done:
+                break
+        else:
+            parser.feed(decoder.decode(b"", final=True))
+            parser.close()
+    return collector.close()
+
+# Score a text block by how much it looks like article content (Readability-style)
+def score_text_block(block):
+    """Higher for long, punctuated, link-poor text; zero for boilerplate and link lists"""
+    text = block["text"]
+    link_density = block["link_chars"] / len(text)
+    if block["boilerplate"] or link_density > 0.5 or len(text) < 25:
+        return 0.0
+    score = 1 + text.count(",") + text.count(". ") + min(len(text) / 100, 3)
+    return score * (1 - link_density)
+
+# Pick the main content of a page as one or more passages
+def extract_main_content(collector, limit=None):
+    """Group consecutive content blocks into passages, keep the best scoring ones
+    (in page order) up to the character limit; fall back to plain page text"""
+    limit = limit or PAGE_TEXT_LIMIT
+    title = next((block["text"] for block in collector.blocks if block["tag"] == "title"), "")
+
+    passages = []
+    current = None
+    pending_heading = None
+    for index, block in enumerate(collector.blocks):
+        score = score_text_block(block)
+        if score > 0:
+            if current is None:
+                current = {"start": index, "texts": [], "score": 0.0}
+                # Keep the heading right before a passage with it
+                if pending_heading:
+                    current["texts"].append(pending_heading)
+            current["texts"].append(block["text"])
+            current["score"] += score
+            pending_heading = None
+        elif block["tag"] in ("h1", "h2", "h3", "h4") and not block["boilerplate"]:
+            if current is not None:
+                passages.append(current)
+                current = None
+            pending_heading = block["text"]
+        elif len(block["text"]) >= 25 or block["boilerplate"]:
+            # Boilerplate or link lists end the passage; short inline leftovers don't
+            if current is not None:
+                passages.append(current)
+                current = None
+            pending_heading = None
+    if current is not None:
+        passages.append(current)
+
+    if not passages:
+        return collector.text()[:limit]
+
+    selected = []
+    used = len(title)
+    for passage in sorted(passages, key=lambda p: p["score"], reverse=True)[:PAGE_MAX_PASSAGES]:
+        text = "\n".join(passage["texts"])
+        if selected and used + len(text) > limit:
+            continue
+        selected.append((passage["start"], text[:limit - used]))
+        used += len(text) + 2
+    content = "\n\n".join(text for _, text in sorted(selected))
+    return f"{title}\n\n{content}" if title else content
+
+# Normalize a URL so trivially different links share one cache entry
+def canonical_url(url):
+    """Lowercase scheme/host, drop default ports, fragments and tracking parameters, sort the query"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and not ((scheme == "http" and parts.port == 80) or (scheme == "https" and parts.port == 443)):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in ("fbclid", "gclid")
+    )
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+# Download and extract a page, revalidating a previously cached copy with
+# ETag/Last-Modified instead of re-downloading it
+def download_webpage(url, previous=None):
+    """Return {"content", "etag", "last_modified", "error"} for the page"""
+    headers = {}
+    if previous and not previous["error"]:
+        if previous["etag"]:
+            headers["If-None-Match"] = previous["etag"]
+        if previous["last_modified"]:
+            headers["If-Modified-Since"] = previous["last_modified"]
+    page_stats = get_page_cache_stats()
+
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        # Stream the body under a byte cap and stop once there's enough text
+        with get_http_client().stream(url, timeout=5, max_bytes=PAGE_MAX_BYTES, headers=headers or None) as (response, chunks):  # Reduced timeout
+            if response.status_code == 304 and headers:
+                page_stats["revalidated"] += 1
+                return previous
+            if response.status_code != 200:
+                return {"content": "Could not fetch webpage", "etag": None, "last_modified": None, "error": True}
+            collector = PageTextCollector(max_chars=PAGE_PARSE_TEXT_LIMIT)
+            parse_html_stream(chunks, response_charset(response), collector)
+
+        page_stats["fetched"] += 1
+        return {
+            "content": extract_main_content(collector),  # Limit to 5000 characters
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "error": False
         }
-        response = requests.get(url, headers=headers, timeout=5)  # Reduced timeout
+    except Exception as e:
+        return {"content": f"Error fetching webpage: {str(e)}", "etag": None, "last_modified": None, "error": True}
 
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, 'html.parser')
+# Fetch webpage content with caching - keyed by canonical URL, served fresh for
+# PAGE_FRESH_SECONDS, then stale while it is revalidated in the background
+def fetch_webpage(url):
+    """Fetch a webpage and extract its main content"""
+    page = get_web_cache("page").get_or_load(
+        canonical_url(url),
+        lambda previous: download_webpage(url, previous),
+        ttl=PAGE_FRESH_SECONDS,
+        stale_seconds=PAGE_STALE_SECONDS,
+        negative_ttl=WEB_NEGATIVE_CACHE_TTL,
+        is_negative=lambda page: page["error"]
+    )
+    return page["content"]
+
+# Thread pool for concurrent page fetches, shared by all sessions in the process
+@st.cache_resource
+def get_fetch_executor():
+    return ThreadPoolExecutor(max_workers=FETCH_MAX_WORKERS, thread_name_prefix="fetch")
+
+# Fetch several webpages at once under one overall deadline
+def fetch_webpages(urls, deadline=None):
+    """Fetch pages concurrently (through the fetch_webpage cache) and return
+    (url, content) pairs in the original order for the pages that finished in time"""
+    deadline = FETCH_DEADLINE_SECONDS if deadline is None else deadline
+    urls = list(dict.fromkeys(urls))  # Fetch each URL once
+    executor = get_fetch_executor()
+    futures = [executor.submit(fetch_webpage, url) for url in urls]
+    wait(futures, timeout=deadline)
+
+    pages = []
+    for url, future in zip(urls, futures):
+        if future.done() and future.exception() is None:
+            pages.append((url, future.result()))
+        else:
+            # Too slow - leave it running so the result still lands in the cache
+            print(f"Skipped {url}: not fetched within {deadline}s")
+    return pages
+
+# Words ignored when ranking web content against the prompt
+RETRIEVAL_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how", "i",
+    "in", "is", "it", "me", "my", "of", "on", "or", "please", "tell", "that", "the", "this", "to",
+    "was", "what", "when", "where", "which", "who", "why", "with", "you", "your"
+}
 
-            # Remove script and style elements
-            for script in soup(["script", "style"]):
-                script.decompose()
+# Lowercased word tokens for lexical ranking
+def retrieval_terms(text):
+    return [term for term in re.findall(r"\w+", text.lower()) if term not in RETRIEVAL_STOPWORDS]
+
+# Split text into passages of roughly RETRIEVAL_CHUNK_CHARS, breaking at paragraphs then sentences
+def split_into_chunks(text, max_chars=None):
+    max_chars = max_chars or RETRIEVAL_CHUNK_CHARS
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n|\n", text):
+        paragraph = paragraph.strip()
+        if len(paragraph) <= max_chars:
+            if paragraph:
+                pieces.append(paragraph)
+        else:
+            pieces.extend(sentence for sentence in re.split(r"(?<=[.!?])\s+", paragraph) if sentence)
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + len(piece) + 1 > max_chars:
+            chunks.append(current)
+            current = ""
+        # Hard-split anything that is still too long (no sentence breaks)
+        while len(piece) > max_chars:
+            chunks.append(piece[:max_chars])
+            piece = piece[max_chars:]
+        current = f"{current}\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+# Chunk a document and count its terms once - reused across turns and sessions
+@st.cache_data(max_entries=128, show_spinner=False)
+def index_document(text):
+    """Return the document's chunks with a term-frequency dict and length for each"""
+    chunks = split_into_chunks(text)
+    entries = []
+    for chunk in chunks:
+        terms = retrieval_terms(chunk)
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        entries.append((chunk, counts, len(terms)))
+    return entries
+
+# Rank indexed chunks against the query with Okapi BM25
+def bm25_scores(query_terms, entries, k1=1.5, b=0.75):
+    """Score each (chunk, term_counts, length) entry; IDF is computed over the entries given"""
+    if not entries:
+        return []
+    total = len(entries)
+    average_length = sum(length for _, _, length in entries) / total or 1
+    query_terms = set(query_terms)
+    document_frequency = {term: sum(1 for _, counts, _ in entries if term in counts) for term in query_terms}
+
+    scores = []
+    for _, counts, length in entries:
+        score = 0.0
+        for term in query_terms:
+            frequency = counts.get(term)
+            if not frequency:
+                continue
+            df = document_frequency[term]
+            idf = np.log(1 + (total - df + 0.5) / (df + 0.5))
+            score += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * length / average_length))
+        scores.append(score)
+    return scores
+
+# Pick the chunks of several sources that best match the prompt within a token budget
+def select_relevant_chunks(query, sources, budget=None):
+    """Return [(label, [chunks...])] in source order, each source's chunks in document order.
+    Every source gets its best chunk first (if it fits), then the remaining budget goes
+    to the highest scoring chunks overall; unmatched chunks fill in from the top of each page."""
+    budget = budget or WEB_CONTEXT_TOKEN_BUDGET
+    indexed = [(label, index_document(text)) for label, text in sources]
+    flat = [(source, position, entry) for source, (_, entries) in enumerate(indexed) for position, entry in enumerate(entries)]
+    scores = bm25_scores(retrieval_terms(query), [entry for _, _, entry in flat])
+
+    # Ties (and no matches at all) fall back to earlier chunks first
+    ranked = sorted(range(len(flat)), key=lambda i: (-scores[i], flat[i][1], flat[i][0]))
+    chosen = set()
+    used = 0
+    best_per_source = {}
+    for i in ranked:
+        best_per_source.setdefault(flat[i][0], i)
+    for i in [*best_per_source.values(), *ranked]:
+        if i in chosen or len(chosen) >= RETRIEVAL_TOP_K:
+            continue
+        cost = estimate_tokens(flat[i][2][0])
+        if used + cost > budget:
+            continue
+        chosen.add(i)
+        used += cost
+
+    selected = [(label, []) for label, _ in indexed]
+    for i in sorted(chosen, key=lambda i: (flat[i][0], flat[i][1])):
+        selected[flat[i][0]][1].append(flat[i][2][0])
+    retrieval_stats = get_retrieval_stats()
+    retrieval_stats["selections"] += 1
+    retrieval_stats["chunks_seen"] += len(flat)
+    retrieval_stats["chunks_kept"] += len(chosen)
+    retrieval_stats["tokens_kept"] += used
+    return [(label, chunks) for label, chunks in selected if chunks]
+
+# Chunk selection counters
+@st.cache_resource
+def get_retrieval_stats():
+    return {"selections": 0, "chunks_seen": 0, "chunks_kept": 0, "tokens_kept": 0}
+
+# Format fetched pages for the prompt, keeping only the passages relevant to it
+def build_page_context(query, pages):
+    web_context = ""
+    query = re.sub(r'https?://[^\s]+', " ", query)  # The links themselves aren't search terms
+    for url, chunks in select_relevant_chunks(query, pages):
+        web_context += f"\n\n[Content from {url}]:\n" + "\n...\n".join(chunks) + "\n"
+    return web_context
+
+# Format search results for the prompt, keeping the ones relevant to it (original numbering)
+def build_search_context(query, search_results):
+    results = [result for result in search_results if "error" not in result]
+    sources = [(i, f"{result['title']}\n{result['snippet']}") for i, result in enumerate(results)]
+    web_context = "\n\n[Web Search Results]:\n"
+    for i, _ in select_relevant_chunks(query, sources):
+        result = results[i]
+        web_context += f"{i+1}. {result['title']}\n"
+        web_context += f"   {result['snippet']}\n"
+        web_context += f"   URL: {result['link']}\n\n"
+    return web_context
+
+# Search-intent rules per response language: (weight, phrases). Phrases are regex
+# fragments matched on word boundaries (anywhere for languages that attach particles
+# or don't separate words with spaces);
+# English rules always apply since prompts are often English whatever the setting
+SEARCH_INTENT_RULES = {
+    "English": [
+        (2.0, [r"weather", r"forecast", r"temperature outside", r"news", r"headlines?", r"latest", r"look up",
+               r"search (?:for|the web|online)", r"google", r"near me", r"right now", r"stock price",
+               r"exchange rate", r"live score", r"breaking"]),
+        (1.0, [r"today", r"tonight", r"tomorrow", r"yesterday", r"this (?:week|month|year)", r"current(?:ly)?",
+               r"recent(?:ly)?", r"20[2-9]\d", r"who is", r"who won", r"when is", r"where is", r"price of",
+               r"release date", r"open now", r"schedule", r"president", r"prime minister", r"ceo", r"score"]),
+        (0.5, [r"what is", r"what's", r"find"]),
+        (-2.0, [r"how to say", r"translate", r"in (?:english|spanish|french|german|japanese|chinese|korean|russian|arabic|portuguese)",
+                r"write (?:me )?(?:a|an|the|some)", r"poem", r"story", r"joke", r"code", r"function", r"explain",
+                r"meaning of", r"define", r"summarize", r"calculate", r"rewrite", r"correct (?:my|this)"])
+    ],
+    "Español (Spanish)": [
+        (2.0, [r"clima", r"el tiempo", r"pronóstico", r"noticias", r"últim[oa]s?", r"busca(?:r)?", r"cotización"]),
+        (1.0, [r"hoy", r"mañana", r"ayer", r"actual(?:mente)?", r"reciente(?:s|mente)?", r"precio", r"quién es", r"quién ganó"]),
+        (-2.0, [r"traduce", r"cómo se dice", r"escribe", r"poema", r"cuento", r"chiste", r"explica"])
+    ],
+    "Français (French)": [
+        (2.0, [r"météo", r"prévisions?", r"actualités?", r"nouvelles", r"derni(?:er|ère)s?", r"cherche(?:r)?", r"recherche"]),
+        (1.0, [r"aujourd'hui", r"demain", r"hier", r"actuel(?:le)?(?:ment)?", r"récent(?:e|s|es)?", r"prix", r"qui est", r"qui a gagné"]),
+        (-2.0, [r"tradui[st]", r"comment dit-on", r"écris", r"poème", r"histoire", r"blague", r"explique"])
+    ],
+    "Deutsch (German)": [
+        (2.0, [r"wetter", r"vorhersage", r"nachrichten", r"neueste[nrs]?", r"such(?:e|en)", r"aktienkurs"]),
+        (1.0, [r"heute", r"morgen", r"gestern", r"aktuell(?:e[nrs]?)?", r"kürzlich", r"preis", r"wer ist", r"wer hat gewonnen"]),
+        (-2.0, [r"übersetze", r"wie sagt man", r"schreib(?:e)?", r"gedicht", r"geschichte", r"witz", r"erkläre?"])
+    ],
+    "Português (Portuguese)": [
+        (2.0, [r"clima", r"previsão", r"notícias", r"últim[oa]s?", r"pesquis(?:e|ar)", r"procur(?:e|ar)", r"cotação"]),
+        (1.0, [r"hoje", r"amanhã", r"ontem", r"atual(?:mente)?", r"recente(?:s|mente)?", r"preço", r"quem é", r"quem ganhou"]),
+        (-2.0, [r"traduza", r"como se diz", r"escreva", r"poema", r"história", r"piada", r"explique"])
+    ],
+    "Русский (Russian)": [
+        (2.0, [r"погод[аеуы]", r"прогноз", r"новост(?:и|ей)", r"последн(?:ие|их|яя)", r"найди", r"поищи", r"курс"]),
+        (1.0, [r"сегодня", r"завтра", r"вчера", r"сейчас", r"текущ(?:ий|ая|ие)", r"цена", r"кто такой", r"кто выиграл"]),
+        (-2.0, [r"переведи", r"как сказать", r"напиши", r"стих(?:и|отворение)?", r"рассказ", r"шутк[ау]", r"объясни"])
+    ],
+    "中文 (Chinese)": [
+        (2.0, [r"天气", r"新闻", r"最新", r"搜索", r"查一下", r"股价", r"汇率"]),
+        (1.0, [r"今天", r"明天", r"昨天", r"现在", r"目前", r"最近", r"价格", r"谁赢了"]),
+        (-2.0, [r"翻译", r"怎么说", r"写一", r"诗", r"故事", r"笑话", r"解释"])
+    ],
+    "日本語 (Japanese)": [
+        (2.0, [r"天気", r"ニュース", r"最新", r"検索", r"調べて", r"株価", r"為替"]),
+        (1.0, [r"今日", r"明日", r"昨日", r"現在", r"最近", r"価格", r"値段"]),
+        (-2.0, [r"翻訳", r"何と言", r"書いて", r"詩", r"物語", r"冗談", r"説明して"])
+    ],
+    "한국어 (Korean)": [
+        (2.0, [r"날씨", r"뉴스", r"최신", r"검색", r"찾아(?:줘|봐)", r"주가", r"환율"]),
+        (1.0, [r"오늘", r"내일", r"어제", r"현재", r"요즘", r"최근", r"가격"]),
+        (-2.0, [r"번역", r"어떻게 말", r"써 ?줘", r"시를", r"이야기", r"농담", r"설명해"])
+    ],
+    "العربية (Arabic)": [
+        (2.0, [r"طقس", r"الطقس", r"أخبار", r"الأخبار", r"أحدث", r"ابحث", r"سعر الصرف"]),
+        (1.0, [r"اليوم", r"غدا", r"أمس", r"الآن", r"حاليا", r"مؤخرا", r"سعر", r"من هو", r"من فاز"]),
+        (-2.0, [r"ترجم", r"كيف أقول", r"اكتب", r"قصيدة", r"قصة", r"نكتة", r"اشرح"])
+    ]
+}
+# Languages matched without word boundaries
+SEARCH_INTENT_UNSPACED = {"中文 (Chinese)", "日本語 (Japanese)", "한국어 (Korean)", "العربية (Arabic)"}
 
-            # Get text
-            text = soup.get_text()
-            lines = (line.strip() for line in text.splitlines())
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            text = ' '.join(chunk for chunk in chunks if chunk)
+# Compile the rules for a response language once - one alternation per weight
+@st.cache_resource
+def get_search_intent_patterns(language):
+    patterns = []
+    for rule_language in dict.fromkeys(["English", language]):
+        for weight, phrases in SEARCH_INTENT_RULES.get(rule_language, []):
+            alternation = "|".join(phrases)
+            if rule_language in SEARCH_INTENT_UNSPACED:
+                pattern = re.compile(f"(?:{alternation})")
+            else:
+                pattern = re.compile(f"(?<!\\w)(?:{alternation})(?!\\w)", re.IGNORECASE)
+            patterns.append((weight, pattern))
+    return patterns
 
-            return text[:5000]  # Limit to 5000 characters
-        return "Could not fetch webpage"
+# Counters for how the search decision went
+@st.cache_resource
+def get_search_intent_stats():
+    return {"searched": 0, "skipped": 0, "skipped_keyword_match": 0, "probe_searched": 0, "probe_skipped": 0, "probe_failed": 0}
+
+# Decide whether a prompt needs fresh information from the web
+def classify_search_intent(prompt, language="English"):
+    """Score the prompt against the weighted rules (each distinct phrase counts once)
+    and return (should_search, score, matched phrases)"""
+    score = 0.0
+    matched = []
+    for weight, pattern in get_search_intent_patterns(language):
+        for phrase in dict.fromkeys(match.lower() for match in pattern.findall(prompt)):
+            score += weight
+            matched.append(f"{phrase}({weight:+g})")
+    return score >= SEARCH_INTENT_THRESHOLD, score, matched
+
+# Fetch linked pages or search the web and format the result for the prompt
+def lookup_web_context(prompt, urls, should_search):
+    """Return (web_context, number of search results found)"""
+    if urls:
+        # Only the passages that match the question go into the prompt
+        return build_page_context(prompt, fetch_webpages(urls)), 0
+    if not should_search:
+        return "", 0
+    search_results = web_search(prompt, num_results=5)
+    if search_results and len(search_results) > 0:
+        return build_search_context(prompt, search_results), len(search_results)
+    return "\n\n[Web search was attempted but no results were found]", 0
+
+# Thread pool for web lookups started ahead of prompt assembly (pipelined mode)
+@st.cache_resource
+def get_lookup_executor():
+    return ThreadPoolExecutor(max_workers=LOOKUP_MAX_WORKERS, thread_name_prefix="lookup")
+
+# Ask the model whether a borderline prompt needs the web (runs alongside the search)
+def probe_search_needed(model, prompt):
+    """Return True (YES) or False (NO), or None when the probe failed or gave no clear answer"""
+    try:
+        response = model.generate_content(
+            "Answer YES or NO only. Does a good answer to the message below need current "
+            "information from the web (news, prices, weather, schedules, recent events)?\n\n"
+            f"Message: {prompt}",
+            generation_config={
+                'max_output_tokens': SEARCH_PROBE_MAX_TOKENS,
+                'temperature': 0
+            }
+        )
+        answer = re.match(r'\W*(YES|NO)\b', response.text.upper())
+        if answer:
+            return answer.group(1) == "YES"
+        print(f"Search probe gave no YES/NO answer, keeping the search: {response.text[:50]!r}")
     except Exception as e:
-        return f"Error fetching webpage: {str(e)}"
+        print(f"Search probe failed, keeping the search: {str(e)}")
+    return None
 
 # Convert image to base64 for vision API
 def image_to_base64(image_file):
@@ -182,119 +1082,484 @@ def image_to_base64(image_file):
         st.error(f"Error converting image: {str(e)}")
         return None
 
+# Grid size used for the pixel analysis (64x64 = 4096 pixels)
+IMAGE_GRID_SIZE = 64
+
+# Instructions appended after every image analysis
+IMAGE_ANALYSIS_INSTRUCTIONS = (
+    "\n=== CRITICAL ANALYSIS INSTRUCTIONS ===\n"
+    "You are analyzing a 64x64 pixel grid (4096 pixels total) in hexadecimal RGB format.\n"
+    "Each 6-character code is one pixel (RRGGBB hex). Example: FFFFFF=white, 000000=black.\n\n"
+    "IMPORTANT: Carefully examine the ENTIRE pixel grid pattern to identify:\n"
+    "1. ANIMALS: Look for fur textures, body shapes, faces, eyes, ears, tails\n"
+    "   - Light beige/cream (F5E5D0-FFFAF0) = light colored fur (dogs, cats)\n"
+    "   - Dark patterns around center = eyes, nose, facial features\n"
+    "2. PEOPLE: Skin tones, clothing, hair, facial features, body poses\n"
+    "3. OBJECTS: Shapes, textures, consistent color patterns\n"
+    "4. BACKGROUNDS: Green tones = grass/nature, Blue = sky/water, etc.\n"
+    "5. EDGE PATTERNS: High edge density = detailed objects with defined shapes\n\n"
+    "DO NOT guess based only on color! Analyze the SHAPE and PATTERN in the pixel grid.\n"
+    "The pixel data contains the actual visual structure - decode it carefully!\n"
+)
+
+# Analyze raw image bytes - cached by content hash so old images in the history
+# aren't re-analyzed on every turn (least recently used entries are evicted)
+@st.cache_data(max_entries=64, show_spinner=False)
+def analyze_image_bytes(image_bytes):
+    """Build the pixel grid, color and edge analysis for an image using NumPy"""
+    img = Image.open(BytesIO(image_bytes))
+
+    # Resize for processing - using 64x64 for much better detail (4096 pixels)
+    # Higher resolution = better recognition accuracy
+    img_small = img.resize((IMAGE_GRID_SIZE, IMAGE_GRID_SIZE), Image.Resampling.LANCZOS)
+
+    # Convert to RGB if necessary
+    if img_small.mode != 'RGB':
+        img_small = img_small.convert('RGB')
+
+    # Get image metadata
+    width, height = img.size
+    format_type = img.format if img.format else "Unknown"
+
+    # Pixel array with shape (rows, columns, RGB)
+    pixels = np.asarray(img_small, dtype=np.uint8)
+
+    # Build enhanced text representation
+    text_rep = [
+        f"\n[IMAGE ANALYSIS START]\n",
+        f"Original Size: {width}x{height} pixels\n",
+        f"Format: {format_type}\n",
+        f"Analyzed at: 64x64 resolution (4096 pixels)\n\n",
+        # Use compact hexadecimal representation to save tokens
+        "PIXEL GRID (Hex RGB format for high accuracy):\n",
+        "Format: Each row is 64 pixels, each pixel as RRGGBB hex\n\n"
+    ]
+
+    # Hex encode the whole grid at once, then split it into 6-character pixel codes
+    # (e.g., FF00AA instead of (255,0,170))
+    hex_codes = np.frombuffer(pixels.tobytes().hex().upper().encode('ascii'), dtype='S6')
+    hex_rows = hex_codes.reshape(IMAGE_GRID_SIZE, IMAGE_GRID_SIZE)
+    text_rep.extend(b" ".join(row).decode('ascii') + "\n" for row in hex_rows)
+
+    # Add color analysis
+    text_rep.append("\n[COLOR ANALYSIS]\n")
+    # Get average color (integer division, same as summing every pixel)
+    pixel_count = IMAGE_GRID_SIZE * IMAGE_GRID_SIZE
+    channel_sums = pixels.reshape(-1, 3).sum(axis=0, dtype=np.int64)
+    avg_r, avg_g, avg_b = (int(total) // pixel_count for total in channel_sums)
+    text_rep.append(f"Average Color: RGB({avg_r}, {avg_g}, {avg_b})\n")
+
+    # Detect dominant colors
+    if avg_r > avg_g and avg_r > avg_b:
+        dominant = "Red tones"
+    elif avg_g > avg_r and avg_g > avg_b:
+        dominant = "Green tones"
+    elif avg_b > avg_r and avg_b > avg_g:
+        dominant = "Blue tones"
+    else:
+        dominant = "Neutral/Gray tones"
+    text_rep.append(f"Dominant Color: {dominant}\n")
+
+    # Brightness analysis
+    brightness = (avg_r + avg_g + avg_b) // 3
+    if brightness > 200:
+        brightness_level = "Very Bright"
+    elif brightness > 150:
+        brightness_level = "Bright"
+    elif brightness > 100:
+        brightness_level = "Medium"
+    elif brightness > 50:
+        brightness_level = "Dark"
+    else:
+        brightness_level = "Very Dark"
+    text_rep.append(f"Brightness: {brightness_level} (avg: {brightness}/255)\n")
+
+    # Add edge detection analysis for better object recognition
+    text_rep.append("\n[EDGE DETECTION]\n")
+    # Simple edge detection: compare each pixel's brightness with its right and
+    # lower neighbors, skipping the outer border of the grid
+    gray = pixels.sum(axis=2, dtype=np.int32) // 3
+    inner = gray[1:-1, 1:-1]
+    right = gray[1:-1, 2:]
+    down = gray[2:, 1:-1]
+    # If significant brightness difference, mark as edge
+    edge_mask = (np.abs(inner - right) > 30) | (np.abs(inner - down) > 30)
+    edge_ys, edge_xs = np.nonzero(edge_mask)
+    edge_count = len(edge_xs)
+
+    text_rep.append(f"Edges Detected: {edge_count} edge points (indicates object boundaries)\n")
+
+    # Analyze edge distribution (+1 converts back to full grid coordinates)
+    if edge_count:
+        avg_edge_x = (int(edge_xs.sum()) + edge_count) / edge_count
+        avg_edge_y = (int(edge_ys.sum()) + edge_count) / edge_count
+        text_rep.append(f"Edge Center: ({avg_edge_x:.1f}, {avg_edge_y:.1f}) - main object location\n")
+
+    text_rep.append("\n[IMAGE ANALYSIS END]\n")
+    text_rep.append(IMAGE_ANALYSIS_INSTRUCTIONS)
+
+    return "".join(text_rep)
+
 # Convert image to text representation with pixel data
 def image_to_text_representation(image_file):
     """Convert image to detailed text representation with enhanced recognition"""
     try:
-        # Read and open image
+        # Read the raw bytes - the analysis itself is cached by content
         image_file.seek(0)
-        img = Image.open(image_file)
-
-        # Resize for processing - using 64x64 for much better detail (4096 pixels)
-        # Higher resolution = better recognition accuracy
-        img_small = img.resize((64, 64), Image.Resampling.LANCZOS)
-
-        # Convert to RGB if necessary
-        if img_small.mode != 'RGB':
-            img_small = img_small.convert('RGB')
+        return analyze_image_bytes(image_file.read())
+    except Exception as e:
+        return f"\n[ERROR: Could not process image - {str(e)}]\n"
 
-        # Get image metadata
-        width, height = img.size
-        format_type = img.format if img.format else "Unknown"
+# Downscale and re-encode image bytes for Gemini - cached by content and settings
+@st.cache_data(max_entries=64, show_spinner=False)
+def encode_image_for_gemini(image_bytes, max_size, quality):
+    """Shrink an image to max_size on its longest side and return it as a JPEG part"""
+    img = Image.open(BytesIO(image_bytes))
+    img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    if img.mode in ('RGBA', 'LA', 'P'):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        img = background
+    elif img.mode != 'RGB':
+        img = img.convert('RGB')
+    buffer = BytesIO()
+    img.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return {"mime_type": "image/jpeg", "data": buffer.getvalue()}
+
+# Convert image to a native multimodal part for Gemini
+def image_to_gemini_part(image_file):
+    """Convert uploaded image to an inline image part, or None if it can't be encoded"""
+    try:
+        image_file.seek(0)
+        return encode_image_for_gemini(image_file.read(), GEMINI_IMAGE_MAX_SIZE, GEMINI_IMAGE_QUALITY)
+    except Exception as e:
+        print(f"Could not encode image for Gemini, using text fallback: {str(e)}")
+        return None
 
-        # Build enhanced text representation
-        text_rep = f"\n[IMAGE ANALYSIS START]\n"
-        text_rep += f"Original Size: {width}x{height} pixels\n"
-        text_rep += f"Format: {format_type}\n"
-        text_rep += f"Analyzed at: 64x64 resolution (4096 pixels)\n\n"
+# Shared content-addressed store for chat attachments (deduplicated across messages and sessions)
+@st.cache_resource
+def get_attachment_store():
+    return DiskLRUCache(os.path.join(CACHE_DIR, "attachments"), ATTACHMENT_STORE_MAX_BYTES)
+
+# Per-session LRU of recently used attachment bytes - past the cap the least recently
+# used ones are spilled (dropped from memory, they stay on disk)
+class SessionBlobCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.spills = 0
+
+    def get(self, key):
+        data = self.entries.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return
+        self.entries[key] = data
+        self.total_bytes += len(data)
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            _, spilled = self.entries.popitem(last=False)
+            self.total_bytes -= len(spilled)
+            self.spills += 1
+
+def get_session_blob_cache():
+    if "attachment_cache" not in st.session_state:
+        st.session_state.attachment_cache = SessionBlobCache(ATTACHMENT_SESSION_MAX_BYTES)
+    return st.session_state.attachment_cache
+
+# Save an uploaded image and return the reference stored in the message (key, name, size, thumbnail)
+def save_attachment(data, name=None):
+    key = hashlib.sha256(data).hexdigest()
+    attachment_store = get_attachment_store()
+    if not attachment_store.contains(key):
+        attachment_store.put(key, data)
+    get_session_blob_cache().put(key, data)
 
-        # Use compact hexadecimal representation to save tokens
-        text_rep += "PIXEL GRID (Hex RGB format for high accuracy):\n"
-        text_rep += "Format: Each row is 64 pixels, each pixel as RRGGBB hex\n\n"
-
-        pixels = img_small.load()
-        for y in range(64):
-            row_data = []
-            for x in range(64):
-                r, g, b = pixels[x, y]
-                # Convert to compact hex format (e.g., FF00AA instead of (255,0,170))
-                row_data.append(f"{r:02X}{g:02X}{b:02X}")
-            text_rep += " ".join(row_data) + "\n"
-
-        # Add color analysis
-        text_rep += "\n[COLOR ANALYSIS]\n"
-        # Get average color
-        img_array = list(img_small.getdata())
-        avg_r = sum(p[0] for p in img_array) // len(img_array)
-        avg_g = sum(p[1] for p in img_array) // len(img_array)
-        avg_b = sum(p[2] for p in img_array) // len(img_array)
-        text_rep += f"Average Color: RGB({avg_r}, {avg_g}, {avg_b})\n"
-
-        # Detect dominant colors
-        if avg_r > avg_g and avg_r > avg_b:
-            dominant = "Red tones"
-        elif avg_g > avg_r and avg_g > avg_b:
-            dominant = "Green tones"
-        elif avg_b > avg_r and avg_b > avg_g:
-            dominant = "Blue tones"
+    try:
+        image = Image.open(BytesIO(data))
+        image.thumbnail((ATTACHMENT_THUMBNAIL_SIZE, ATTACHMENT_THUMBNAIL_SIZE))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        buf = BytesIO()
+        image.save(buf, format="JPEG", quality=85)
+        thumbnail = buf.getvalue()
+    except Exception as e:
+        print(f"Could not create attachment thumbnail: {str(e)}")
+        thumbnail = None
+    return {"attachment": key, "name": name, "size": len(data), "thumbnail": thumbnail}
+
+# Raw bytes of an attachment: session memory, then disk (the thumbnail if it was evicted)
+def load_attachment(ref):
+    blob_cache = get_session_blob_cache()
+    data = blob_cache.get(ref["attachment"])
+    if data is None:
+        data = get_attachment_store().get(ref["attachment"])
+        if data is None:
+            print(f"Attachment {ref['attachment'][:12]} was evicted, using its thumbnail")
+            return ref["thumbnail"]
+        blob_cache.put(ref["attachment"], data)
+    return data
+
+# Encoded Gemini parts for attachments, shared by all sessions and keyed by content hash
+@st.cache_resource
+def get_encoded_attachment_cache():
+    return MemoryLRUCache(ATTACHMENT_ENCODED_MAX_ENTRIES)
+
+# An attachment as it is sent to Gemini: an image part, or its pixel grid text in the text
+# mode (or if encoding fails) - the full image is only loaded and encoded on a miss
+def attachment_prompt_part(ref):
+    encoded_cache = get_encoded_attachment_cache()
+    cache_key = (ref["attachment"], IMAGE_INPUT_MODE, GEMINI_IMAGE_MAX_SIZE, GEMINI_IMAGE_QUALITY)
+    prompt_part = encoded_cache.get(cache_key)
+    if prompt_part is None:
+        data = load_attachment(ref)
+        prompt_part = image_to_gemini_part(BytesIO(data)) if IMAGE_INPUT_MODE == "native" else None
+        if prompt_part is None:
+            prompt_part = image_to_text_representation(BytesIO(data))
+        # An evicted attachment falls back to its thumbnail - don't cache that under the full image's key
+        if data is not ref["thumbnail"]:
+            encoded_cache.put(cache_key, prompt_part)
+    return prompt_part
+
+# What a session keeps in memory for attachments and avatars
+def attachment_session_usage(messages):
+    thumbnails = sum(
+        len(ref["thumbnail"] or b"")
+        for message in messages if isinstance(message["content"], dict)
+        for ref in message["content"].get("images", [])
+    )
+    avatars = sum(len(avatar) for avatar in (st.session_state.profile_photo, st.session_state.ai_avatar) if isinstance(avatar, bytes))
+    blob_cache = get_session_blob_cache()
+    return {"thumbnails": thumbnails, "avatars": avatars, "cached": blob_cache.total_bytes, "spills": blob_cache.spills}
+
+# Merge a list of text and image parts into Gemini message parts
+def merge_text_parts(parts):
+    """Join runs of adjacent text parts so each message holds as few parts as possible"""
+    merged = []
+    text_run = []
+    for part in parts:
+        if isinstance(part, str):
+            text_run.append(part)
+            continue
+        if text_run:
+            text = "".join(text_run)
+            if text:
+                merged.append(text)
+            text_run = []
+        merged.append(part)
+    if text_run:
+        text = "".join(text_run)
+        if text:
+            merged.append(text)
+    return merged
+
+# Render one chat message into a Gemini content entry ({"role": ..., "parts": [...]})
+def render_prompt_fragment(message):
+    """Convert a chat message to a user/model turn with vision support"""
+    role = "user" if message["role"] == "user" else "model"
+    content = message["content"]
+    if not isinstance(content, dict):
+        return {"role": role, "parts": [content] if content else []}
+
+    # Check if this message has images - filter out None or empty objects
+    valid_images = [img for img in content.get("images", []) if img is not None]
+
+    # Send images as native image parts (text pixel grid as fallback)
+    parts = [content.get("text", "")]
+    for idx, image_ref in enumerate(valid_images):
+        prompt_part = attachment_prompt_part(image_ref)
+        if isinstance(prompt_part, dict):
+            parts.extend([f"\n\n--- IMAGE {idx + 1} ---\n", prompt_part])
         else:
-            dominant = "Neutral/Gray tones"
-        text_rep += f"Dominant Color: {dominant}\n"
-
-        # Brightness analysis
-        brightness = (avg_r + avg_g + avg_b) // 3
-        if brightness > 200:
-            brightness_level = "Very Bright"
-        elif brightness > 150:
-            brightness_level = "Bright"
-        elif brightness > 100:
-            brightness_level = "Medium"
-        elif brightness > 50:
-            brightness_level = "Dark"
+            parts.append(f"\n\n--- IMAGE {idx + 1} ---\n{prompt_part}\n")
+
+    return {"role": role, "parts": merge_text_parts(parts)}
+
+# Get a message's Gemini content, rendering it only the first time it is sent
+def get_prompt_fragment(message):
+    """Return the cached Gemini content stored on the message. Messages with images
+    aren't cached (the encoded images would stay in session memory) - their image
+    parts are cached per process by attachment hash instead"""
+    fragment = message.get("prompt_content")
+    if fragment is None:
+        fragment = render_prompt_fragment(message)
+        if not (isinstance(message["content"], dict) and message["content"].get("images")):
+            message["prompt_content"] = fragment
+    return fragment
+
+# Assemble the multi-turn Gemini request from the message contents
+def build_conversation_contents(messages, web_context="", summary=""):
+    """Build the user/model turns; the summary opens the history and web context goes on the last user message"""
+    contents = []
+    if summary:
+        contents.append({"role": "user", "parts": [f"[Summary of earlier conversation]:\n{summary}"]})
+
+    last_index = len(messages) - 1
+    for i, message in enumerate(messages):
+        fragment = get_prompt_fragment(message)
+        parts = fragment["parts"]
+        # Add web context to the last user message
+        if i == last_index and message["role"] == "user" and web_context:
+            parts = merge_text_parts([*parts, web_context])
+        if not parts:
+            continue
+        # Gemini expects user and model turns to alternate - merge repeated roles
+        if contents and contents[-1]["role"] == fragment["role"]:
+            contents[-1] = {"role": fragment["role"], "parts": merge_text_parts([*contents[-1]["parts"], "\n\n", *parts])}
         else:
-            brightness_level = "Very Dark"
-        text_rep += f"Brightness: {brightness_level} (avg: {brightness}/255)\n"
-
-        # Add edge detection analysis for better object recognition
-        text_rep += "\n[EDGE DETECTION]\n"
-        edges_detected = []
-        for y in range(1, 63):  # Skip first and last row
-            for x in range(1, 63):  # Skip first and last column
-                # Simple edge detection: check brightness difference with neighbors
-                curr = sum(pixels[x, y]) // 3
-                right = sum(pixels[x + 1, y]) // 3
-                down = sum(pixels[x, y + 1]) // 3
-
-                # If significant brightness difference, mark as edge
-                if abs(curr - right) > 30 or abs(curr - down) > 30:
-                    edges_detected.append((x, y))
-
-        text_rep += f"Edges Detected: {len(edges_detected)} edge points (indicates object boundaries)\n"
-
-        # Analyze edge distribution
-        if edges_detected:
-            avg_edge_x = sum(e[0] for e in edges_detected) / len(edges_detected)
-            avg_edge_y = sum(e[1] for e in edges_detected) / len(edges_detected)
-            text_rep += f"Edge Center: ({avg_edge_x:.1f}, {avg_edge_y:.1f}) - main object location\n"
-
-        text_rep += "\n[IMAGE ANALYSIS END]\n"
-        text_rep += "\n=== CRITICAL ANALYSIS INSTRUCTIONS ===\n"
-        text_rep += "You are analyzing a 64x64 pixel grid (4096 pixels total) in hexadecimal RGB format.\n"
-        text_rep += "Each 6-character code is one pixel (RRGGBB hex). Example: FFFFFF=white, 000000=black.\n\n"
-        text_rep += "IMPORTANT: Carefully examine the ENTIRE pixel grid pattern to identify:\n"
-        text_rep += "1. ANIMALS: Look for fur textures, body shapes, faces, eyes, ears, tails\n"
-        text_rep += "   - Light beige/cream (F5E5D0-FFFAF0) = light colored fur (dogs, cats)\n"
-        text_rep += "   - Dark patterns around center = eyes, nose, facial features\n"
-        text_rep += "2. PEOPLE: Skin tones, clothing, hair, facial features, body poses\n"
-        text_rep += "3. OBJECTS: Shapes, textures, consistent color patterns\n"
-        text_rep += "4. BACKGROUNDS: Green tones = grass/nature, Blue = sky/water, etc.\n"
-        text_rep += "5. EDGE PATTERNS: High edge density = detailed objects with defined shapes\n\n"
-        text_rep += "DO NOT guess based only on color! Analyze the SHAPE and PATTERN in the pixel grid.\n"
-        text_rep += "The pixel data contains the actual visual structure - decode it carefully!\n"
-
-        return text_rep
+            contents.append({"role": fragment["role"], "parts": parts})
+    return contents
+
+# Rough local token estimate (~4 characters per token) - avoids a count_tokens round-trip
+def estimate_tokens(text):
+    """Estimate the number of tokens in a piece of text"""
+    return len(text) // 4 + 1
+
+# Estimate tokens for a message's prompt fragment (cached on the message)
+def get_prompt_tokens(message):
+    """Return the estimated token cost of a message, images counted at a fixed rate"""
+    tokens = message.get("prompt_tokens")
+    if tokens is None:
+        tokens = sum(
+            estimate_tokens(part) if isinstance(part, str) else IMAGE_TOKEN_ESTIMATE
+            for part in get_prompt_fragment(message)["parts"]
+        )
+        message["prompt_tokens"] = tokens
+    return tokens
+
+# Find where a newest-first window of messages that fits the budget starts
+def find_window_start(messages, budget, first_allowed=0):
+    """Return the index of the oldest message that still fits in the token budget"""
+    used = 0
+    start = len(messages)
+    while start > first_allowed:
+        tokens = get_prompt_tokens(messages[start - 1])
+        # Always keep the newest message, even if it alone is over budget
+        if used + tokens > budget and start < len(messages):
+            break
+        used += tokens
+        start -= 1
+    return start
+
+# Plain text version of a message for the running summary (no image data)
+def message_summary_text(message):
+    """Return "User: ..." / "Assistant: ..." text with images noted but not included"""
+    prefix = "User" if message["role"] == "user" else "Assistant"
+    content = message["content"]
+    if isinstance(content, dict):
+        images = [img for img in content.get("images", []) if img is not None]
+        text = content.get("text", "")
+        if images:
+            text += f" [{len(images)} image{'s' if len(images) > 1 else ''} attached]"
+    else:
+        text = content
+    return f"{prefix}: {text}"
+
+# Keep a running summary within SUMMARY_MAX_TOKENS (the newest part is kept)
+def cap_summary(text):
+    max_chars = SUMMARY_MAX_TOKENS * 4
+    return text if len(text) <= max_chars else "..." + text[-(max_chars - 3):]
+
+# Fold messages that left the context window into the running summary
+def summarize_messages(model, previous_summary, messages):
+    """Ask the model for an updated summary covering the previous summary and new messages"""
+    transcript = "\n\n".join(message_summary_text(m) for m in messages)
+    prompt = (
+        "Summarize the conversation below between a user and an AI assistant so it can be "
+        "continued later. Keep names, facts, preferences, decisions and open questions. "
+        "Be concise and write plain text.\n\n"
+    )
+    if previous_summary:
+        prompt += f"Summary so far:\n{previous_summary}\n\n"
+    prompt += f"New messages:\n{transcript}"
+
+    try:
+        response = model.generate_content(
+            prompt,
+            generation_config={
+                'max_output_tokens': SUMMARY_MAX_TOKENS,
+                'temperature': 0.2
+            }
+        )
+        return cap_summary(response.text.strip())
     except Exception as e:
-        return f"\n[ERROR: Could not process image - {str(e)}]\n"
+        print(f"Summary generation failed, keeping a truncated transcript: {str(e)}")
+        excerpt = "\n".join(message_summary_text(m)[:200] for m in messages)
+        return cap_summary(f"{previous_summary}\n{excerpt}".strip())
+
+# Pick the messages to send and keep the running summary of older ones up to date
+def get_context_window(model, messages, budget):
+    """Return (window, summary) for a token budget, refreshing the summary only when stale"""
+    summary = st.session_state.context_summary
+    # Chat was cleared or shortened - start over
+    if summary["covered"] > len(messages):
+        summary = {"text": "", "covered": 0}
+
+    # The summary is sent too, so it comes out of the same budget
+    summary_tokens = estimate_tokens(summary["text"]) if summary["text"] else 0
+    start = find_window_start(messages, budget - summary_tokens, summary["covered"])
+    if start > summary["covered"]:
+        # Over budget: evict down to the low-water mark so the summary isn't redone every turn,
+        # leaving room for the new summary (at most SUMMARY_MAX_TOKENS)
+        start = find_window_start(messages, int(budget * CONTEXT_REFILL_RATIO) - SUMMARY_MAX_TOKENS, summary["covered"])
+        summary = {
+            "text": summarize_messages(model, summary["text"], messages[summary["covered"]:start]),
+            "covered": start
+        }
+    st.session_state.context_summary = summary
+    return messages[summary["covered"]:], summary["text"]
+
+# Render a streamed response without re-sending the whole text on every chunk
+class StreamingRenderer:
+    """Accumulate streamed text and redraw the placeholder at most every interval_ms or flush_chars"""
+
+    def __init__(self, placeholder, interval_ms=None, flush_chars=None, cursor="▌"):
+        self.placeholder = placeholder
+        self.interval = (STREAM_FLUSH_INTERVAL_MS if interval_ms is None else interval_ms) / 1000
+        self.flush_chars = STREAM_FLUSH_CHARS if flush_chars is None else flush_chars
+        self.cursor = cursor
+        self.parts = []
+        self.pending_chars = 0
+        self.last_render = 0.0
+        self.chunks_received = 0
+        self.renders_issued = 0
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+    def add(self, text):
+        """Add a chunk and redraw if enough time or text has accumulated"""
+        self.chunks_received += 1
+        self.parts.append(text)
+        self.pending_chars += len(text)
+        if self.pending_chars >= self.flush_chars or time.monotonic() - self.last_render >= self.interval:
+            self._render(self.text + self.cursor)
+
+    def finish(self):
+        """Final redraw without the cursor"""
+        self._render(self.text)
+        return self.text
+
+    def stats(self):
+        return {"chunks_received": self.chunks_received, "renders_issued": self.renders_issued}
+
+    def _render(self, text):
+        self.placeholder.markdown(text)
+        self.renders_issued += 1
+        self.pending_chars = 0
+        self.last_render = time.monotonic()
 
 # Email validation function
 def is_valid_email(email):
@@ -315,30 +1580,149 @@ def is_valid_password(password):
         return False, "Password must contain at least 1 number"
     return True, "Password is valid"
 
-def generate_tts_audio(text, message_index):
-    """Generate TTS audio for a message using AWS Polly and cache it in session state"""
-    if not polly_client:
-        return None
+# Size-bounded file cache shared by every session and process using the same directory
+class DiskLRUCache:
+    """Store values as files named by key, evicting least recently used files over max_bytes"""
+
+    def __init__(self, directory, max_bytes, suffix=""):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(size for _, _, size in self._entries())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def _entries(self):
+        """List (path, last used time, size) for every cached file"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(self.suffix) and not entry.name.startswith("."):
+                stat = entry.stat()
+                entries.append((entry.path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def get(self, key):
+        """Return the cached bytes for key, or None on a miss"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # Mark as recently used
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return data
+
+    def contains(self, key):
+        return os.path.exists(self._path(key))
+
+    def put(self, key, data):
+        """Write bytes for key atomically, then evict old files if over the size limit"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+        with self.lock:
+            self.total_bytes += len(data)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Delete least recently used files until the cache fits (caller holds the lock)"""
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self.total_bytes = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.total_bytes -= size
+                self.evictions += 1
+            except OSError:
+                pass
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "bytes": self.total_bytes
+        }
 
-    # Check if audio already exists in cache
-    if message_index in st.session_state.tts_audio:
-        return st.session_state.tts_audio[message_index]
+# Shared TTS audio cache (survives reruns, sessions and restarts)
+@st.cache_resource
+def get_tts_cache():
+    return DiskLRUCache(os.path.join(CACHE_DIR, "tts"), TTS_CACHE_MAX_BYTES, suffix=".mp3")
+
+# Cache key for a TTS clip - the same text spoken the same way always maps to one file
+def tts_cache_key(text, voice_id, engine, language_code):
+    """Hash the text and voice settings into a content address"""
+    payload = json.dumps([text, voice_id, engine, language_code], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+# Split text into sentence-aligned chunks for parallel synthesis
+def split_tts_chunks(text, max_chars=None, first_max_chars=None):
+    """Split text at sentence boundaries; the first chunk is kept short so playback starts sooner"""
+    max_chars = max_chars or TTS_CHUNK_CHARS
+    limit = first_max_chars or TTS_FIRST_CHUNK_CHARS
+    chunks = []
+    current = ""
+    for sentence in re.split(r'(?<=[.!?。！？])\s+', text.strip()):
+        # Break up sentences that are too long on their own at a space
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+            limit = max_chars
+        if current and len(current) + 1 + len(sentence) > limit:
+            chunks.append(current)
+            current = sentence
+            limit = max_chars
+        elif sentence:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+# Thread pool for Polly calls, shared by all sessions in the process
+@st.cache_resource
+def get_tts_executor():
+    return ThreadPoolExecutor(max_workers=TTS_MAX_WORKERS, thread_name_prefix="tts")
+
+# Synthesize one chunk of text (runs on the TTS thread pool - no session state here)
+def synthesize_tts_chunk(text, voice_id, engine, language_code):
+    """Return MP3 bytes for a chunk, from the shared cache or AWS Polly"""
+    tts_cache = get_tts_cache()
+    cache_key = tts_cache_key(text, voice_id, engine, language_code)
+    audio_bytes = tts_cache.get(cache_key)
+    if audio_bytes is not None:
+        return audio_bytes
 
     try:
-        # Limit text length to avoid very long audio files
-        if len(text) > 1500:
-            text = text[:1500] + "..."
-
-        # Get selected voice from session state
-        voice_id = st.session_state.get('selected_voice', 'Joanna')
-
         # Generate speech using AWS Polly
         response = polly_client.synthesize_speech(
             Text=text,
-            Engine='standard',
+            Engine=engine,
             VoiceId=voice_id,
             OutputFormat='mp3',
-            LanguageCode='en-US'
+            LanguageCode=language_code
         )
 
         # Read audio stream directly
@@ -346,31 +1730,509 @@ def generate_tts_audio(text, message_index):
             audio_bytes = response['AudioStream'].read()
 
             # Cache the audio
-            st.session_state.tts_audio[message_index] = audio_bytes
+            tts_cache.put(cache_key, audio_bytes)
 
             return audio_bytes
         else:
             return None
 
-    except (BotoCoreError, ClientError) as e:
-        return None
     except Exception as e:
+        # Covers botocore's BotoCoreError/ClientError without importing botocore up front
         return None
 
+# Current TTS voice settings
+def get_tts_settings():
+    """Return (voice_id, engine, language_code) for the selected voice"""
+    return st.session_state.get('selected_voice', 'Joanna'), 'standard', 'en-US'
+
+# Look up a message's full audio without synthesizing anything
+def get_cached_tts_audio(text):
+    """Return the stitched audio for a message if it is already cached"""
+    return get_tts_cache().get(tts_cache_key(text, *get_tts_settings()))
+
+# Start synthesizing all chunks of a message concurrently
+def start_tts_synthesis(text):
+    """Submit every sentence chunk to the TTS pool and return the futures in order"""
+    if not polly_client:
+        return []
+    executor = get_tts_executor()
+    settings = get_tts_settings()
+    return [executor.submit(synthesize_tts_chunk, chunk, *settings) for chunk in split_tts_chunks(text)]
+
+# Wait for chunk futures and stitch the MP3 segments into one clip
+def finish_tts_synthesis(text, futures):
+    """Join the chunk audio (MP3 frames can be concatenated) and cache the full clip"""
+    segments = [future.result() for future in futures]
+    if not segments or any(segment is None for segment in segments):
+        return None
+    audio_bytes = b"".join(segments)
+    get_tts_cache().put(tts_cache_key(text, *get_tts_settings()), audio_bytes)
+    return audio_bytes
+
+# TTS audio for a chat message - the clip's cache key is kept on the message, so reruns
+# don't rehash the text (recomputed if the voice changes)
+def get_message_tts_audio(message):
+    content = message["content"]
+    text = content if isinstance(content, str) else content.get("text", "")
+    settings = get_tts_settings()
+    if message.get("tts_key", (None,))[0] != settings:
+        message["tts_key"] = (settings, tts_cache_key(text, *settings))
+    audio_bytes = get_tts_cache().get(message["tts_key"][1])
+    if audio_bytes is None:
+        audio_bytes = generate_tts_audio(text)
+    return audio_bytes
+
+def generate_tts_audio(text):
+    """Generate TTS audio for a message using AWS Polly, cached across sessions by content"""
+    if not polly_client:
+        return None
+
+    # Check if audio already exists in cache
+    audio_bytes = get_cached_tts_audio(text)
+    if audio_bytes is not None:
+        return audio_bytes
+
+    return finish_tts_synthesis(text, start_tts_synthesis(text))
+
+# HTML audio element that starts playing immediately
+def autoplay_audio_html(audio_bytes):
+    """Embed MP3 bytes in an autoplaying audio element"""
+    # Convert audio bytes to base64 for HTML embedding
+    audio_base64 = base64.b64encode(audio_bytes).decode()
+    return f"""
+        <audio autoplay controls style="width: 100%;">
+            <source src="data:audio/mpeg;base64,{audio_base64}" type="audio/mpeg">
+        </audio>
+    """
+
+# HTML audio element that starts once an earlier element on the page has finished
+def chained_audio_html(audio_bytes, element_id, after_id):
+    """Embed MP3 bytes that play when the `after_id` audio ends (or right away if it already has)"""
+    audio_base64 = base64.b64encode(audio_bytes).decode()
+    return f"""
+        <audio id="{element_id}" controls preload="auto" style="width: 100%;" src="data:audio/mpeg;base64,{audio_base64}"></audio>
+        <script>
+            (() => {{
+                const previous = document.getElementById("{after_id}");
+                const next = document.getElementById("{element_id}");
+                if (!next) return;
+                const start = () => next.play().catch(() => {{}});
+                if (previous && !previous.ended) {{
+                    previous.addEventListener("ended", start, {{ once: true }});
+                }} else {{
+                    start();
+                }}
+            }})();
+        </script>
+    """
+
+# Play a new response as soon as its first sentence chunk is synthesized
+def play_tts_early(text):
+    """Autoplay the first chunk while the rest synthesize, then chain the rest after it"""
+    audio_bytes = get_cached_tts_audio(text)
+    if audio_bytes is not None:
+        st.markdown(autoplay_audio_html(audio_bytes), unsafe_allow_html=True)
+        return
+
+    futures = start_tts_synthesis(text)
+    if not futures:
+        return
+    first_segment = futures[0].result()
+    player_id = f"tts-{tts_cache_key(text, *get_tts_settings())[:12]}"
+    if first_segment:
+        st.html(f'<audio id="{player_id}-first" autoplay controls style="width: 100%;" '
+                f'src="data:audio/mpeg;base64,{base64.b64encode(first_segment).decode()}"></audio>')
+
+    audio_bytes = finish_tts_synthesis(text, futures)
+    if audio_bytes and len(futures) > 1:
+        # Only the remaining segments - they start when the first chunk ends, so the whole answer plays
+        rest_bytes = b"".join(future.result() for future in futures[1:])
+        st.html(chained_audio_html(rest_bytes, f"{player_id}-rest", f"{player_id}-first"),
+                unsafe_allow_javascript=True)
+    if audio_bytes:
+        st.download_button(
+            label="📥 Download audio",
+            data=audio_bytes,
+            file_name=f"response_{datetime.now().strftime('%Y%m%d_%H%M%S')}.mp3",
+            mime="audio/mpeg",
+            key="tts_download"
+        )
+
+# Everything that determines a generated image
+@dataclass(frozen=True)
+class ImageGenerationParams:
+    prompt: str
+    width: int = 1024
+    height: int = 1024
+    guidance_scale: Optional[float] = None  # None - not sent, the model uses its own default
+    steps: Optional[int] = None
+    seed: Optional[int] = None
+    draft: bool = False  # Low resolution, few steps preview of these settings
+
+    def resolved(self):
+        """The settings actually sent - drafts are scaled down (multiples of 16) with fewer steps"""
+        if not self.draft:
+            return self
+        scale = min(1.0, IMAGE_DRAFT_MAX_SIDE / max(self.width, self.height))
+        draft_steps = (IMAGE_MODEL_SETTINGS.get(IMAGE_MODEL) or {}).get("draft_steps")
+        return replace(
+            self,
+            width=max(16, round(self.width * scale / 16) * 16),
+            height=max(16, round(self.height * scale / 16) * 16),
+            steps=min(self.steps or draft_steps, draft_steps) if draft_steps else self.steps
+        )
+
+    def label(self):
+        settings = self.resolved()
+        steps = f", {settings.steps} steps" if settings.steps is not None else ""
+        guidance = f", guidance {settings.guidance_scale:g}" if settings.guidance_scale is not None else ""
+        seed = f", seed {self.seed}" if self.seed is not None else ""
+        return f"{'Draft ' if self.draft else ''}{settings.width}x{settings.height}{steps}{guidance}{seed}"
+
+# Run one text-to-image call and return the result as PNG bytes
+def generate_image_png(client, params):
+    settings = params.resolved()
+    # Only send what was set - distilled models reject or ignore steps and guidance outside their range
+    options = {
+        name: value for name, value in (
+            ("num_inference_steps", settings.steps),
+            ("guidance_scale", settings.guidance_scale),
+            ("seed", settings.seed)
+        ) if value is not None
+    }
+    image = client.text_to_image(
+        prompt=settings.prompt,
+        model=IMAGE_MODEL,
+        width=settings.width,
+        height=settings.height,
+        **options
+    )
+    buf = BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+# Replace any art style suffix on a prompt with the given style ("None" just removes it)
+def apply_art_style(prompt, style, styles):
+    for existing in styles:
+        if existing != "All Styles" and existing != "None":
+            prompt = prompt.replace(f", {existing.lower()} style", "")
+            prompt = prompt.replace(f" {existing.lower()} style", "")
+    prompt = prompt.strip()
+    if style in ("All Styles", "None"):
+        return prompt
+    return f"{prompt}, {style.lower()} style"
+
+# Background image generation - jobs from every session share one worker pool
+class ImageJobQueue:
+    """Run generation jobs on a fixed number of workers (the per-process cap on concurrent
+    inference calls), refuse new jobs past max_jobs pending, and keep each job's
+    status until its session collects the result"""
+
+    def __init__(self, max_workers, max_jobs):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="imagegen")
+        self.max_jobs = max_jobs
+        self.lock = threading.Lock()
+        self.jobs = {}
+
+    def submit(self, session_id, generate, **details):
+        """Queue generate() (returns PNG bytes) and return the job ID, or None if the queue is full"""
+        with self.lock:
+            self._prune()
+            pending = sum(1 for job in self.jobs.values() if job["status"] in ("queued", "running"))
+            if pending >= self.max_jobs:
+                return None
+            job_id = uuid.uuid4().hex[:8]
+            self.jobs[job_id] = {
+                "id": job_id,
+                "session": session_id,
+                "status": "queued",
+                "error": None,
+                "image_bytes": None,
+                "submitted_at": time.time(),
+                "finished_at": None,
+                **details
+            }
+        self.executor.submit(self._run, job_id, generate)
+        return job_id
+
+    def _run(self, job_id, generate):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            job["status"] = "running"
+        try:
+            image_bytes, status, error = generate(), "done", None
+        except Exception as e:
+            image_bytes, status, error = None, "failed", str(e)
+        with self.lock:
+            job.update(status=status, error=error, image_bytes=image_bytes, finished_at=time.time())
+
+    def session_jobs(self, session_id):
+        """Snapshot of a session's jobs, oldest first"""
+        with self.lock:
+            jobs = [dict(job) for job in self.jobs.values() if job["session"] == session_id]
+        return sorted(jobs, key=lambda job: job["submitted_at"])
+
+    def collect_finished(self, session_id):
+        """Remove and return a session's finished (done or failed) jobs, oldest first"""
+        with self.lock:
+            finished = [job for job in self.jobs.values() if job["session"] == session_id and job["finished_at"]]
+            for job in finished:
+                del self.jobs[job["id"]]
+        return sorted(finished, key=lambda job: job["finished_at"])
+
+    def _prune(self):
+        """Drop results nobody collected (tab closed) after IMAGE_JOB_RETENTION_SECONDS (caller holds the lock)"""
+        cutoff = time.time() - IMAGE_JOB_RETENTION_SECONDS
+        for job_id in [job["id"] for job in self.jobs.values() if job["finished_at"] and job["finished_at"] < cutoff]:
+            del self.jobs[job_id]
+
+    def stats(self):
+        with self.lock:
+            statuses = [job["status"] for job in self.jobs.values()]
+        return {status: statuses.count(status) for status in ("queued", "running", "done", "failed")}
+
+@st.cache_resource
+def get_image_job_queue():
+    return ImageJobQueue(IMAGE_MAX_CONCURRENT, IMAGE_QUEUE_MAX_JOBS)
+
+# Generated images on disk, keyed by content hash (identical images are stored once)
+@st.cache_resource
+def get_image_store():
+    return DiskLRUCache(os.path.join(CACHE_DIR, "images"), IMAGE_STORE_MAX_BYTES, ".png")
+
+# Store a generated PNG and build its history entry - session state only keeps a thumbnail
+def store_generated_image(image_bytes, **details):
+    image_key = hashlib.sha256(image_bytes).hexdigest()
+    image_store = get_image_store()
+    if not image_store.contains(image_key):
+        image_store.put(image_key, image_bytes)
+
+    image = Image.open(BytesIO(image_bytes))
+    full_size = image.size
+    image.thumbnail((IMAGE_THUMBNAIL_SIZE, IMAGE_THUMBNAIL_SIZE))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    buf = BytesIO()
+    image.save(buf, format="JPEG", quality=85)
+    return {
+        'image_key': image_key,
+        'thumbnail': buf.getvalue(),
+        'image_size': full_size,
+        'file_bytes': len(image_bytes),
+        **details
+    }
+
+# Full PNG for a history entry, read from disk only when needed (None if it was evicted)
+def load_generated_image(image_data):
+    return get_image_store().get(image_data['image_key'])
+
+# Bytes a session's image history keeps in memory vs. on disk
+def image_history_usage(history):
+    return {
+        "memory": sum(len(image_data['thumbnail']) for image_data in history),
+        "disk": sum(image_data['file_bytes'] for image_data in history)
+    }
+
+# Seeded generations: request hash -> stored image, shared across sessions and processes
+@st.cache_resource
+def get_generation_cache():
+    return TieredCache("generation", IMAGE_CACHE_MAX_ENTRIES, get_web_cache_store())
+
+# Hash of everything that determines a seeded image
+def generation_cache_key(params, style):
+    settings = params.resolved()
+    payload = json.dumps([
+        IMAGE_MODEL, settings.prompt, style, settings.width, settings.height,
+        settings.steps, settings.guidance_scale, settings.seed
+    ], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+# Generate an image, reusing the earlier result for a repeated seeded request
+def generate_image_cached(client, params, style):
+    """Return PNG bytes - unseeded requests always run inference"""
+    if params.seed is None:
+        return generate_image_png(client, params)
+
+    image_store = get_image_store()
+    generated = {}
+
+    def generate(previous):
+        image_bytes = generate_image_png(client, params)
+        image_key = hashlib.sha256(image_bytes).hexdigest()
+        image_store.put(image_key, image_bytes)
+        generated["bytes"] = image_bytes
+        return image_key
+
+    cache_key = generation_cache_key(params, style)
+    generation_cache = get_generation_cache()
+    image_key = generation_cache.get_or_load(
+        cache_key, generate,
+        ttl=IMAGE_CACHE_TTL,
+        stale_seconds=0,
+        negative_ttl=0,
+        is_negative=lambda image_key: False
+    )
+    image_bytes = generated.get("bytes") or image_store.get(image_key)
+    if image_bytes is None:
+        # The image itself was evicted from disk - generate it again
+        generation_cache.put(cache_key, generate(None), IMAGE_CACHE_TTL)
+        image_bytes = generated["bytes"]
+    return image_bytes
+
+# Download button that reads the full image from disk only when clicked
+def image_download_button(image_data, label, file_name, key, **kwargs):
+    if get_image_store().contains(image_data['image_key']):
+        st.download_button(
+            label=label,
+            data=partial(load_generated_image, image_data),
+            file_name=file_name,
+            mime="image/png",
+            key=key,
+            **kwargs
+        )
+    else:
+        st.button(label, key=key, disabled=True, help="The full image is no longer cached", **{k: v for k, v in kwargs.items() if k != "help"})
+
 # Load environment variables
 load_dotenv()
 
-# Initialize Gemini client with caching
+# Directory for caches shared across sessions and processes
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(tempfile.gettempdir(), "ethel-chat-cache"))
+# Chat attachments: shared disk store size, per-session memory cap and thumbnail size
+ATTACHMENT_STORE_MAX_BYTES = int(os.getenv("ATTACHMENT_STORE_MAX_MB", "1000")) * 1024 * 1024
+ATTACHMENT_SESSION_MAX_BYTES = int(os.getenv("ATTACHMENT_SESSION_MAX_MB", "16")) * 1024 * 1024
+ATTACHMENT_THUMBNAIL_SIZE = 300
+# Encoded attachment parts (downscaled JPEG ~100 KB, or pixel grid text) kept in memory for re-sending
+ATTACHMENT_ENCODED_MAX_ENTRIES = int(os.getenv("ATTACHMENT_ENCODED_MAX_ENTRIES", "128"))
+# Maximum size of the TTS audio cache on disk
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_MB", "200")) * 1024 * 1024
+# TTS is synthesized in sentence chunks on a bounded thread pool
+TTS_CHUNK_CHARS = 1000
+TTS_FIRST_CHUNK_CHARS = 250
+TTS_MAX_WORKERS = int(os.getenv("TTS_MAX_WORKERS", "4"))
+
+# How chat images are sent to Gemini: "native" image parts or the "text" pixel grid fallback
+IMAGE_INPUT_MODE = os.getenv("IMAGE_INPUT_MODE", "native").lower()
+# Longest side (pixels) and JPEG quality for images sent as native parts
+GEMINI_IMAGE_MAX_SIZE = int(os.getenv("GEMINI_IMAGE_MAX_SIZE", "768"))
+GEMINI_IMAGE_QUALITY = int(os.getenv("GEMINI_IMAGE_QUALITY", "85"))
+
+# Token budget for the conversation history sent with each request
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "8000"))
+# When the budget overflows, older turns are folded into the summary until the
+# history fits in this fraction of the budget (so the summary isn't rebuilt every turn)
+CONTEXT_REFILL_RATIO = 0.6
+# Estimated token cost of one inline image part
+IMAGE_TOKEN_ESTIMATE = 258
+SUMMARY_MAX_TOKENS = 512
+
+# Streaming display: redraw the response at most every N ms or every M new characters
+STREAM_FLUSH_INTERVAL_MS = int(os.getenv("STREAM_FLUSH_INTERVAL_MS", "100"))
+STREAM_FLUSH_CHARS = int(os.getenv("STREAM_FLUSH_CHARS", "400"))
+# Chat history: messages rendered on each rerun, and how many more "Load earlier" adds
+CHAT_HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "20"))
+
+# Shared HTTP client for web search and page fetches
+HTTP_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+HTTP_POOL_HOSTS = 16  # Hosts with their own keep-alive pool
+HTTP_POOL_SIZE = 8  # Connections kept per host
+HTTP_MAX_RETRIES = 2
+HTTP_MAX_RESPONSE_BYTES = int(os.getenv("HTTP_MAX_RESPONSE_MB", "5")) * 1024 * 1024
+
+# Webpage text extraction: bytes downloaded per page and characters of text kept
+PAGE_MAX_BYTES = int(os.getenv("PAGE_MAX_KB", "1024")) * 1024
+PAGE_TEXT_LIMIT = 5000
+# Text parsed before picking the main content, and how many passages to keep
+PAGE_PARSE_TEXT_LIMIT = PAGE_TEXT_LIMIT * 4
+PAGE_MAX_PASSAGES = 5
+# Extracted pages are served from memory for this long, then revalidated
+PAGE_FRESH_SECONDS = int(os.getenv("PAGE_FRESH_SECONDS", "300"))
+# After that, pages are served stale for up to PAGE_STALE_SECONDS while revalidating
+PAGE_STALE_SECONDS = int(os.getenv("PAGE_STALE_SECONDS", "86400"))
+
+# Pages linked in one prompt are fetched concurrently, within an overall deadline
+FETCH_MAX_WORKERS = 8
+FETCH_DEADLINE_SECONDS = float(os.getenv("FETCH_DEADLINE_SECONDS", "6"))
+# Web search and page caches: "sqlite" shares them across processes and restarts
+# through CACHE_DIR, "memory" keeps them per process
+WEB_CACHE_BACKEND = os.getenv("WEB_CACHE_BACKEND", "sqlite").lower()
+WEB_CACHE_MEMORY_ENTRIES = 256
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "3600"))
+SEARCH_STALE_SECONDS = int(os.getenv("SEARCH_STALE_SECONDS", "600"))
+# Failed fetches and empty searches are retried after this long
+WEB_NEGATIVE_CACHE_TTL = int(os.getenv("WEB_NEGATIVE_CACHE_TTL", "60"))
+# Expired rows are kept this long for revalidation before being pruned
+WEB_CACHE_RETAIN_SECONDS = 7 * 24 * 3600
+# Prompts scoring at least this much against SEARCH_INTENT_RULES trigger a web search
+SEARCH_INTENT_THRESHOLD = float(os.getenv("SEARCH_INTENT_THRESHOLD", "2"))
+# "pipelined" starts the web lookup before the prompt is assembled instead of before it
+WEB_LOOKUP_MODE = os.getenv("WEB_LOOKUP_MODE", "serial").lower()
+LOOKUP_MAX_WORKERS = 4
+# Pipelined mode only: borderline prompts (scoring at least SEARCH_PROBE_MIN_SCORE) search
+# speculatively while a short model call decides whether the results are used
+SEARCH_PROBE = os.getenv("SEARCH_PROBE", "false").lower() == "true"
+SEARCH_PROBE_MIN_SCORE = 0.5
+SEARCH_PROBE_MODEL = os.getenv("SEARCH_PROBE_MODEL", "gemini-2.0-flash-lite")
+SEARCH_PROBE_MAX_TOKENS = 5
+# Web content is split into chunks and only the best matches for the prompt are sent
+RETRIEVAL_CHUNK_CHARS = 800
+RETRIEVAL_TOP_K = 8
+WEB_CONTEXT_TOKEN_BUDGET = int(os.getenv("WEB_CONTEXT_TOKEN_BUDGET", "1500"))
+
+# Seconds before the AWS Polly connection test is repeated
+POLLY_HEALTH_CHECK_TTL = int(os.getenv("POLLY_HEALTH_CHECK_TTL", "600"))
+# Image generation runs in the background: concurrent inference calls per process,
+# pending jobs accepted, how often the page polls them and how long uncollected results are kept
+IMAGE_MAX_CONCURRENT = int(os.getenv("IMAGE_MAX_CONCURRENT", "4"))
+IMAGE_QUEUE_MAX_JOBS = int(os.getenv("IMAGE_QUEUE_MAX_JOBS", "20"))
+IMAGE_JOB_POLL_SECONDS = 2
+# Draft previews: longest side in pixels (draft step counts are per model, see IMAGE_MODEL_SETTINGS)
+IMAGE_DRAFT_MAX_SIDE = int(os.getenv("IMAGE_DRAFT_MAX_SIDE", "512"))
+# Generated images: history entries per session, disk store size and thumbnail size
+IMAGE_HISTORY_MAX = int(os.getenv("IMAGE_HISTORY_MAX", "10"))
+IMAGE_STORE_MAX_BYTES = int(os.getenv("IMAGE_STORE_MAX_MB", "500")) * 1024 * 1024
+IMAGE_THUMBNAIL_SIZE = 256
+# Seeded generation results are reused for this long
+IMAGE_CACHE_TTL = 30 * 24 * 3600
+IMAGE_CACHE_MAX_ENTRIES = 512
+# Largest batch per click and how many recent results stay on the page
+IMAGE_BATCH_MAX = 8
+IMAGE_RESULTS_SHOWN = 9
+IMAGE_JOB_RETENTION_SECONDS = 3600
+
+# Service registry - each backend SDK is imported and its client constructed on
+# first use (cached for the process), so reruns that don't need it stay fast
+
+# Initialize Gemini client with caching - one model per job/personality/language
+# combination so the system instruction is set once instead of re-sent as text
 @st.cache_resource
-def get_gemini_client():
+def get_gemini_client(job=None, personality=None, language=None):
+    import google.generativeai as genai
+
     genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-    return genai.GenerativeModel('gemini-2.5-flash')
+    if job is None:
+        return genai.GenerativeModel('gemini-2.5-flash')
+    return genai.GenerativeModel(
+        'gemini-2.5-flash',
+        system_instruction=build_system_instruction(job, personality, language)
+    )
 
-client = get_gemini_client()
+# Small non-thinking model for the YES/NO search probe - thinking models spend
+# their output token limit on thoughts and return an empty answer (built once per process)
+@st.cache_resource
+def get_search_probe_model(model_name):
+    import google.generativeai as genai
+
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    return genai.GenerativeModel(model_name)
 
 # Configure AWS Polly client for text-to-speech
 @st.cache_resource
 def get_polly_client():
+    import boto3
+
     return boto3.client(
         'polly',
         aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
@@ -378,37 +2240,53 @@ def get_polly_client():
         region_name=os.getenv("AWS_REGION", "us-east-1")
     )
 
-try:
-    if os.getenv("AWS_ACCESS_KEY_ID") and os.getenv("AWS_SECRET_ACCESS_KEY"):
-        polly_client = get_polly_client()
-        # Test if credentials work by trying to describe voices
-        try:
-            polly_client.describe_voices(LanguageCode='en-US')
-            st.session_state.polly_error = None  # Clear any previous errors
-        except Exception as test_error:
-            polly_client = None
-            error_msg = str(test_error)
-            st.session_state.polly_error = f"AWS Polly connection test failed: {error_msg}"
-            print(st.session_state.polly_error)
-    else:
-        polly_client = None
-        st.session_state.polly_error = "AWS credentials not configured in .env file"
-        print(st.session_state.polly_error)
-except Exception as e:
-    polly_client = None
-    st.session_state.polly_error = f"AWS Polly initialization error: {str(e)}"
-    print(st.session_state.polly_error)
+# Test if Polly credentials work - once per process, re-checked after the TTL
+@st.cache_data(ttl=POLLY_HEALTH_CHECK_TTL, show_spinner=False)
+def check_polly_connection():
+    """Return None if Polly is reachable, otherwise an error message"""
+    try:
+        get_polly_client().describe_voices(LanguageCode='en-US')
+        return None
+    except Exception as test_error:
+        error_msg = f"AWS Polly connection test failed: {str(test_error)}"
+        print(error_msg)
+        return error_msg
+
+# Get a working Polly client, or None (with the reason in session state)
+def get_polly_service():
+    """Return the Polly client if credentials are configured and the health check passes"""
+    try:
+        if not (os.getenv("AWS_ACCESS_KEY_ID") and os.getenv("AWS_SECRET_ACCESS_KEY")):
+            st.session_state.polly_error = "AWS credentials not configured in .env file"
+            return None
+        st.session_state.polly_error = check_polly_connection()
+        if st.session_state.polly_error:
+            return None
+        return get_polly_client()
+    except Exception as e:
+        st.session_state.polly_error = f"AWS Polly initialization error: {str(e)}"
+        return None
 
 # Configure HuggingFace client for image generation
 @st.cache_resource
 def get_hf_client():
     token = os.getenv("HUGGINGFACE_TOKEN")
     if token:
+        from huggingface_hub import InferenceClient
+
         return InferenceClient(token=token)
     return None
 
-hf_client = get_hf_client()
-IMAGE_MODEL = "black-forest-labs/FLUX.1-schnell"
+IMAGE_MODEL = os.getenv("IMAGE_MODEL", "black-forest-labs/FLUX.1-schnell")
+# Advanced Settings per image model: steps as (min, max, default), guidance as (min, max, default)
+# or None when the model ignores it, and the steps used for drafts. Models not listed here
+# get neither setting sent, so they run with their own defaults
+IMAGE_MODEL_SETTINGS = {
+    # Distilled 1-4 step model, trained without guidance
+    "black-forest-labs/FLUX.1-schnell": {"steps": (1, 4, 4), "guidance": None, "draft_steps": 2},
+    "black-forest-labs/FLUX.1-dev": {"steps": (10, 50, 28), "guidance": (1.0, 10.0, 3.5), "draft_steps": 10},
+    "stabilityai/stable-diffusion-xl-base-1.0": {"steps": (10, 100, 30), "guidance": (1.0, 20.0, 7.5), "draft_steps": 10}
+}
 
 # Define gradient themes
 themes = {
@@ -1068,6 +2946,16 @@ personality_icons = {
     "Humorous": "😄"
 }
 
+# Extra system notes (for API - always in English)
+internet_note = "You have access to the internet. When users ask about current events, recent information, or provide URLs, use the web search results or webpage content provided in the context."
+# The pixel grid note is only needed when images are sent as text
+image_analysis_note = "" if IMAGE_INPUT_MODE == "native" else "\n\nENHANCED IMAGE ANALYSIS: When you receive [IMAGE ANALYSIS START]...[IMAGE ANALYSIS END] sections, you're getting a 32x32 pixel grid (1024 pixels total) in hexadecimal RGB format. Each pixel is 6 hex characters (RRGGBB). The data includes: 1) Full pixel grid in hex format, 2) Color analysis (average color, dominant tones, brightness), 3) Edge detection data showing object boundaries and locations. Use ALL this data together to accurately identify objects, people, animals, text, scenes, and content. The 32x32 resolution with hex encoding provides good detail while staying token-efficient. Edge detection helps you locate and identify distinct objects in the image."
+
+# Build the system instruction for a job/personality/language combination
+def build_system_instruction(job, personality, language):
+    """Combine the job, personality, language and capability notes into one instruction"""
+    return f"{job_prompts[job]} {personality_prompts[personality]} {language_instructions[language]} {internet_note}{image_analysis_note}"
+
 # Get current language translations
 t = ui_translations[st.session_state.language]
 
@@ -1133,6 +3021,9 @@ if not st.session_state.signed_in:
 
 # IMAGE GENERATOR MODE
 if st.session_state.image_generator_mode:
+    # Image generation backend (None if no HuggingFace token is configured)
+    hf_client = get_hf_client()
+
     st.title("🎨 AI Image Generator")
     st.markdown("Generate stunning images from text descriptions using AI")
 
@@ -1217,15 +3108,9 @@ if st.session_state.image_generator_mode:
                 # Get current prompt or create new one
                 current_prompt = st.session_state.get("image_prompt_value", "")
 
-                # Remove any existing style suffix
-                for style in art_styles:
-                    if style != "All Styles" and style != "None":
-                        current_prompt = current_prompt.replace(f", {style.lower()} style", "")
-                        current_prompt = current_prompt.replace(f" {style.lower()} style", "")
-
-                # Add new style
-                if current_prompt.strip():
-                    st.session_state.image_prompt_value = f"{current_prompt.strip()}, {selected_style.lower()} style"
+                # Replace any existing style suffix with the new style
+                if apply_art_style(current_prompt, "None", art_styles):
+                    st.session_state.image_prompt_value = apply_art_style(current_prompt, selected_style, art_styles)
                 else:
                     st.warning("Please enter a prompt first!")
 
@@ -1233,12 +3118,9 @@ if st.session_state.image_generator_mode:
                 st.success(f"✨ Applied {selected_style} style!")
             elif selected_style == "None":
                 # Remove style from prompt
-                current_prompt = st.session_state.get("image_prompt_value", "")
-                for style in art_styles:
-                    if style != "All Styles" and style != "None":
-                        current_prompt = current_prompt.replace(f", {style.lower()} style", "")
-                        current_prompt = current_prompt.replace(f" {style.lower()} style", "")
-                st.session_state.image_prompt_value = current_prompt.strip()
+                st.session_state.image_prompt_value = apply_art_style(
+                    st.session_state.get("image_prompt_value", ""), "None", art_styles
+                )
                 st.session_state.selected_art_style = "None"
                 st.success("Removed style from prompt")
             else:
@@ -1294,8 +3176,20 @@ if st.session_state.image_generator_mode:
 
         # Advanced Settings
         with st.expander("⚙️ Advanced Settings"):
-            st.slider("Guidance Scale", 1.0, 20.0, 7.5, 0.5, help="How closely to follow the prompt")
-            st.slider("Steps", 10, 100, 50, 5, help="Number of denoising steps")
+            # Ranges follow the selected model - nothing is sent for settings it does not take
+            model_settings = IMAGE_MODEL_SETTINGS.get(IMAGE_MODEL)
+            guidance_scale = inference_steps = None
+            if model_settings:
+                min_steps, max_steps, default_steps = model_settings["steps"]
+                inference_steps = st.slider("Steps", min_steps, max_steps, default_steps, 1, help="Number of denoising steps")
+                if model_settings["guidance"]:
+                    min_guidance, max_guidance, default_guidance = model_settings["guidance"]
+                    guidance_scale = st.slider("Guidance Scale", min_guidance, max_guidance, default_guidance, 0.5,
+                                               help="How closely to follow the prompt")
+                else:
+                    st.caption(f"{IMAGE_MODEL.split('/')[-1]} does not use a guidance scale")
+            else:
+                st.caption(f"{IMAGE_MODEL} runs with its default steps and guidance")
 
         st.divider()
 
@@ -1327,7 +3221,7 @@ if st.session_state.image_generator_mode:
         st.divider()
 
         # Image History Section in Sidebar
-        st.subheader(f"🖼️ Image History ({len(st.session_state.image_history)}/10)")
+        st.subheader(f"🖼️ Image History ({len(st.session_state.image_history)}/{IMAGE_HISTORY_MAX})")
 
         # Toggle button to show/hide history
         if st.button("📂 View Image History" if not st.session_state.show_image_history else "📂 Hide Image History",
@@ -1338,7 +3232,12 @@ if st.session_state.image_generator_mode:
         # Show history if toggled on
         if st.session_state.show_image_history:
             if st.session_state.image_history:
-                st.caption(f"{len(st.session_state.image_history)} images in history")
+                history_usage = image_history_usage(st.session_state.image_history)
+                st.caption(
+                    f"{len(st.session_state.image_history)} images in history - "
+                    f"{history_usage['memory'] / 1024:.0f} KB in session memory, "
+                    f"{history_usage['disk'] / (1024 * 1024):.1f} MB on disk"
+                )
 
                 # Clear all history button
                 if st.button("🗑️ Clear All History", use_container_width=True, key="clear_all_hist", type="primary"):
@@ -1350,8 +3249,8 @@ if st.session_state.image_generator_mode:
 
                 # Display images (1 per row for sidebar)
                 for idx, img_data in enumerate(st.session_state.image_history):
-                    # Display image
-                    st.image(img_data['image'], use_column_width=True)
+                    # Display thumbnail
+                    st.image(img_data['thumbnail'], use_column_width=True)
 
                     # Show timestamp
                     time_str = img_data['timestamp'].strftime('%H:%M:%S')
@@ -1361,17 +3260,17 @@ if st.session_state.image_generator_mode:
                     with st.expander("📝 Prompt"):
                         st.write(f"**Prompt:** {img_data['prompt']}")
                         st.write(f"**Style:** {img_data['style']}")
+                        st.write(f"**Settings:** {img_data['params'].label()}")
 
                     # Action buttons in columns
                     col1, col2, col3 = st.columns(3)
 
                     with col1:
-                        # Download button
-                        st.download_button(
+                        # Download button (full image is loaded from disk on click)
+                        image_download_button(
+                            img_data,
                             label="📥",
-                            data=img_data['image_bytes'],
                             file_name=f"img_{idx}_{img_data['timestamp'].strftime('%Y%m%d_%H%M%S')}.png",
-                            mime="image/png",
                             key=f"dl_{idx}",
                             help="Download",
                             use_container_width=True
@@ -1382,6 +3281,11 @@ if st.session_state.image_generator_mode:
                         if st.button("🔄", key=f"reuse_{idx}", help="Reuse prompt", use_container_width=True):
                             st.session_state.image_prompt_value = img_data['prompt']
                             st.session_state.selected_art_style = img_data['style']
+                            if img_data['params'].seed is not None:
+                                st.session_state.image_seed_value = img_data['params'].seed
+                                st.session_state.image_fixed_seed = True
+                                # The seed widget keeps its own state - drop it so it picks up the restored seed
+                                st.session_state.pop("image_seed_widget", None)
                             st.session_state.show_image_history = False
                             st.success("Prompt loaded!")
                             st.rerun()
@@ -1451,59 +3355,168 @@ if st.session_state.image_generator_mode:
             </style>
         """, unsafe_allow_html=True)
 
-        # Generate button
-        if st.button("🚀 Generate Image", type="primary", use_container_width=True):
-            if not img_prompt.strip():
+        # Batch options - several images are generated in parallel (up to IMAGE_MAX_CONCURRENT at once)
+        batch_modes = ["Single image", "Seed variations", "Style variants", "Random prompts"]
+        batch_col1, batch_col2, batch_col3 = st.columns([2, 3, 2])
+        with batch_col1:
+            batch_mode = st.selectbox("Batch:", batch_modes, help="Generate several images at once")
+        with batch_col3:
+            draft_mode = st.toggle(
+                "⚡ Draft mode",
+                help="Fast low-resolution previews with fewer steps - render the ones you like at full quality"
+            )
+            fixed_seed = st.toggle(
+                "🎯 Fixed seed",
+                key="image_fixed_seed",
+                help="Deterministic results - repeating the same request returns the cached image instantly"
+            )
+            if fixed_seed:
+                if "image_seed_widget" not in st.session_state:
+                    st.session_state.image_seed_widget = st.session_state.image_seed_value
+                seed_value = st.number_input(
+                    "Seed:", min_value=0, max_value=2 ** 31 - 1,
+                    key="image_seed_widget"
+                )
+                st.session_state.image_seed_value = seed_value
+        with batch_col2:
+            if batch_mode == "Style variants":
+                variant_styles = st.multiselect(
+                    "Styles:",
+                    options=[style for style in art_styles if style not in ("All Styles", "None")],
+                    default=["Digital Art", "Watercolor", "Anime"],
+                    max_selections=IMAGE_BATCH_MAX
+                )
+            elif batch_mode != "Single image":
+                batch_count = st.slider("Number of images:", 2, IMAGE_BATCH_MAX, 4)
+
+        # Generate button - images are generated in the background so the page stays usable
+        if st.button("🚀 Generate Image" if batch_mode == "Single image" else "🚀 Generate Batch", type="primary", use_container_width=True):
+            # Selected size and Advanced Settings apply to every image in the request
+            width, height = size_options[selected_size]
+            base_params = ImageGenerationParams(
+                img_prompt, width, height, guidance_scale, inference_steps,
+                seed=int(seed_value) if fixed_seed else None,
+                draft=draft_mode
+            )
+
+            # (params, style) for every image in the request
+            if batch_mode == "Random prompts":
+                batch = [(replace(base_params, prompt=prompt), "None") for prompt in random.sample(RANDOM_PROMPTS, min(batch_count, len(RANDOM_PROMPTS)))]
+            elif not img_prompt.strip():
+                batch = []
                 st.warning("⚠️ Please enter a description for your image!")
+            elif batch_mode == "Seed variations":
+                # Fixed seed: consecutive seeds, so the whole batch is reproducible
+                seeds = [int(seed_value) + i for i in range(batch_count)] if fixed_seed else [random.randrange(2 ** 31) for _ in range(batch_count)]
+                batch = [(replace(base_params, seed=seed), st.session_state.selected_art_style) for seed in seeds]
+            elif batch_mode == "Style variants":
+                batch = [(replace(base_params, prompt=apply_art_style(img_prompt, style, art_styles)), style) for style in variant_styles]
             else:
-                try:
-                    with st.spinner("🎨 Generating your image... This may take 10-30 seconds..."):
-                        # Generate image
-                        image = hf_client.text_to_image(
-                            prompt=img_prompt,
-                            model=IMAGE_MODEL,
-                            width=1024,
-                            height=1024
-                        )
+                batch = [(base_params, st.session_state.selected_art_style)]
+
+            queued = 0
+            for params, style in batch:
+                # Drafts get a seed so the full render reproduces the same picture
+                if params.draft and params.seed is None:
+                    params = replace(params, seed=random.randrange(2 ** 31))
+                job_id = get_image_job_queue().submit(
+                    st.session_state.session_id,
+                    partial(generate_image_cached, hf_client, params, style),
+                    prompt=params.prompt,
+                    style=style,
+                    params=params
+                )
+                queued += job_id is not None
+            if queued:
+                st.toast(f"🎨 {queued} image job{'s' if queued > 1 else ''} queued - this may take 10-30 seconds")
+            if queued < len(batch):
+                st.warning("⏳ Too many images are being generated right now. Please try again in a moment.")
+
+        # Poll this session's jobs while any are pending
+        image_jobs = get_image_job_queue().session_jobs(st.session_state.session_id)
+        jobs_pending = any(job["status"] in ("queued", "running") for job in image_jobs)
+
+        @st.fragment(run_every=IMAGE_JOB_POLL_SECONDS if jobs_pending else None)
+        def show_image_jobs():
+            finished = get_image_job_queue().collect_finished(st.session_state.session_id)
+            for job in finished:
+                if job["status"] == "done":
+                    # Save to history (full image on disk, thumbnail in the session)
+                    image_data = store_generated_image(
+                        job["image_bytes"],
+                        prompt=job["prompt"],
+                        style=job["style"],
+                        params=job["params"],
+                        timestamp=datetime.fromtimestamp(job["finished_at"])
+                    )
+                    st.session_state.image_history.insert(0, image_data)
+
+                    # Limit history size
+                    if len(st.session_state.image_history) > IMAGE_HISTORY_MAX:
+                        st.session_state.image_history = st.session_state.image_history[:IMAGE_HISTORY_MAX]
+                    result = {"job": job["id"], "image_data": image_data}
+                else:
+                    result = {"job": job["id"], "prompt": job["prompt"], "error": job["error"]}
+                st.session_state.recent_image_results = [result, *st.session_state.recent_image_results][:IMAGE_RESULTS_SHOWN]
+            if finished:
+                # Rerun the whole page so the history and polling pick up the results
+                st.rerun()
 
-                        # Convert PIL Image to bytes for download and storage
-                        buf = BytesIO()
-                        image.save(buf, format="PNG")
-                        byte_im = buf.getvalue()
-                        buf.seek(0)  # Reset buffer position
-
-                        # Save to history
-                        image_data = {
-                            'image': image,
-                            'image_bytes': byte_im,
-                            'prompt': img_prompt,
-                            'style': st.session_state.selected_art_style,
-                            'timestamp': datetime.now()
-                        }
-                        st.session_state.image_history.insert(0, image_data)
-
-                        # Limit to 10 images
-                        if len(st.session_state.image_history) > 10:
-                            st.session_state.image_history = st.session_state.image_history[:10]
-
-                        # Display the generated image
-                        st.success("✅ Image generated successfully!")
-                        st.image(image, caption=f"Generated: {img_prompt}", use_container_width=True)
+            generation_stats = get_generation_cache().stats()
+            if generation_stats["memory_hits"] + generation_stats["store_hits"] + generation_stats["misses"]:
+                st.caption(
+                    f"🎯 Seeded generation cache: {generation_stats['memory_hits'] + generation_stats['store_hits']} hits / "
+                    f"{generation_stats['misses']} misses ({generation_stats['hit_ratio']:.0%}), {generation_stats['coalesced']} coalesced"
+                )
+
+            status_icons = {"queued": "⏳", "running": "🎨"}
+            for job in get_image_job_queue().session_jobs(st.session_state.session_id):
+                st.caption(f"{status_icons.get(job['status'], '✅')} Job {job['id']} {job['status']}: {job['prompt']}")
+
+            # Newest results first, in a grid
+            results = st.session_state.recent_image_results
+            for row_start in range(0, len(results), 3):
+                columns = st.columns(3)
+                for column, result in zip(columns, results[row_start:row_start + 3]):
+                    with column:
+                        if "error" in result:
+                            st.error(f"❌ Error generating image ({result['prompt']}): {result['error']}")
+                            continue
+                        image_data = result["image_data"]
+                        # Thumbnail only - this redraws on every poll, the full image is read when downloaded
+                        st.image(image_data['thumbnail'], caption=f"Generated: {image_data['prompt']}", use_container_width=True)
+                        st.caption(image_data['params'].label())
+
+                        # Re-render a draft at the full settings (same seed)
+                        if image_data['params'].draft and st.button("✨ Full quality", key=f"full_{result['job']}", use_container_width=True):
+                            job_id = get_image_job_queue().submit(
+                                st.session_state.session_id,
+                                partial(generate_image_cached, hf_client, replace(image_data['params'], draft=False), image_data['style']),
+                                prompt=image_data['prompt'],
+                                style=image_data['style'],
+                                params=replace(image_data['params'], draft=False)
+                            )
+                            if job_id:
+                                st.toast(f"🎨 Rendering job {job_id} at full quality")
+                            else:
+                                st.warning("⏳ Too many images are being generated right now. Please try again in a moment.")
+                            st.rerun()
 
                         # Download button
-                        st.download_button(
+                        image_download_button(
+                            image_data,
                             label="📥 Download Image",
-                            data=byte_im,
-                            file_name=f"generated_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png",
-                            mime="image/png"
+                            file_name=f"generated_{image_data['timestamp'].strftime('%Y%m%d_%H%M%S')}_{result['job']}.png",
+                            key=f"dl_result_{result['job']}"
                         )
 
-                except Exception as e:
-                    st.error(f"❌ Error generating image: {str(e)}")
-                    st.info("Please try again or modify your prompt.")
+        show_image_jobs()
 
 # CHAT MODE
 else:
+    # Text-to-speech backend (None if AWS Polly isn't configured or reachable)
+    polly_client = get_polly_service()
+
     # Page title with help button in top right corner
     col_title, col_help = st.columns([6, 1])
     with col_title:
@@ -1571,8 +3584,11 @@ else:
 
         return results
 
-    # Display chat history
-    for idx, message in enumerate(st.session_state.messages):
+    # One chat message, as its own fragment - "Run code" and "🔊 Listen" rerun only this message
+    @st.fragment
+    def show_chat_message(idx):
+        messages = st.session_state.messages
+        message = messages[idx]
         avatar = None
         if message["role"] == "assistant" and st.session_state.ai_avatar is not None:
             avatar = st.session_state.ai_avatar
@@ -1585,8 +3601,9 @@ else:
                 # Message with images
                 st.markdown(message["content"]["text"])
                 if message["content"].get("images"):
-                    for img in message["content"]["images"]:
-                        st.image(img, width=300)
+                    for image_ref in message["content"]["images"]:
+                        if image_ref["thumbnail"]:
+                            st.image(image_ref["thumbnail"], width=300)
             else:
                 # Regular text message
                 st.markdown(message["content"])
@@ -1607,38 +3624,58 @@ else:
                                 st.error(t["error_label"])
                                 st.code(result['error'])
 
-        # Add TTS audio player for assistant messages (outside chat_message container)
+        # Add TTS audio player for assistant messages (outside chat_message container).
+        # Only the latest message and ones the user asked to hear load their audio on a rerun
         if message["role"] == "assistant" and st.session_state.auto_play_tts and polly_client:
-            content_for_tts = content_text if isinstance(message["content"], str) else message["content"].get("text", "")
+            is_latest = idx == len(messages) - 1
+            if not (is_latest or message.get("tts_open")):
+                def open_tts_player():
+                    message["tts_open"] = True
 
-            audio_bytes = generate_tts_audio(content_for_tts, idx)
+                st.button("🔊 Listen", key=f"tts_{idx}", on_click=open_tts_player)
+                return
 
-            if audio_bytes:
-                # Only autoplay the most recent message
-                is_latest = idx == len(st.session_state.messages) - 1
-
-                if is_latest:
-                    # Convert audio bytes to base64 for HTML embedding
-                    audio_base64 = base64.b64encode(audio_bytes).decode()
+            audio_bytes = get_message_tts_audio(message)
 
-                    # Create HTML audio element with autoplay
-                    audio_html = f"""
-                        <audio autoplay controls style="width: 100%;">
-                            <source src="data:audio/mpeg;base64,{audio_base64}" type="audio/mpeg">
-                        </audio>
-                    """
+            if audio_bytes:
+                # Only autoplay the most recent message, and only once
+                if is_latest and st.session_state.tts_autoplayed != idx:
+                    st.session_state.tts_autoplayed = idx
 
                     # Display HTML audio (autoplay)
-                    st.markdown(audio_html, unsafe_allow_html=True)
+                    st.markdown(autoplay_audio_html(audio_bytes), unsafe_allow_html=True)
                 else:
                     # Show regular player for older messages
                     st.audio(audio_bytes, format='audio/mpeg')
 
+    # Display chat history - only the newest CHAT_HISTORY_WINDOW messages are rendered, older
+    # ones on request. Not a fragment itself: the per-message fragments can't be nested in one
+    # on older Streamlit versions (sibling fragments collide when the outer one reruns)
+    def show_chat_history():
+        messages = st.session_state.messages
+        # Back to the default window once the chat is short again (cleared or replaced)
+        if len(messages) <= CHAT_HISTORY_WINDOW:
+            st.session_state.pop("history_window", None)
+        first_shown = max(0, len(messages) - st.session_state.get("history_window", CHAT_HISTORY_WINDOW))
+        if first_shown:
+            def load_earlier_messages():
+                st.session_state.history_window = st.session_state.get("history_window", CHAT_HISTORY_WINDOW) + CHAT_HISTORY_WINDOW
+
+            st.button(f"⬆️ Load earlier messages ({first_shown} hidden)", key="load_earlier",
+                      use_container_width=True, on_click=load_earlier_messages)
+
+        for idx in range(first_shown, len(messages)):
+            show_chat_message(idx)
+
+    show_chat_history()
+
     # Voice input section
     st.markdown("---")
     col_voice, col_text = st.columns([1, 4])
     with col_voice:
         st.write("🎤 Voice:")
+        from audio_recorder_streamlit import audio_recorder
+
         audio_bytes = audio_recorder(
             text="",
             recording_color="#e74c3c",
@@ -1654,6 +3691,8 @@ else:
             st.session_state.last_audio = audio_bytes
 
             with st.spinner("Converting speech to text..."):
+                import speech_recognition as sr
+
                 try:
                     # Initialize recognizer
                     recognizer = sr.Recognizer()
@@ -1689,15 +3728,12 @@ else:
 
     # Handle user input
     if prompt:
-        # Prepare message content with images converted to bytes (so they persist across reruns)
+        # Prepare message content - images go to the attachment store, the message keeps references
         saved_images = []
         if st.session_state.uploaded_images:
             for img_file in st.session_state.uploaded_images:
-                # Convert to bytes so it persists
                 img_file.seek(0)
-                img_bytes = BytesIO(img_file.read())
-                img_bytes.name = img_file.name  # Preserve filename
-                saved_images.append(img_bytes)
+                saved_images.append(save_attachment(img_file.read(), img_file.name))
 
         message_content = {"text": prompt, "images": saved_images if saved_images else []}
 
@@ -1713,11 +3749,13 @@ else:
             st.markdown(prompt)
             # Display uploaded images if any
             if message_content["images"]:
-                for img in message_content["images"]:
-                    st.image(img, width=300)
+                for image_ref in message_content["images"]:
+                    if image_ref["thumbnail"]:
+                        st.image(image_ref["thumbnail"], width=300)
 
         # Check if we need to search the web
         web_context = ""
+        # Old substring keywords, only kept to count the searches the classifier avoids
         search_keywords = ["search", "find", "look up", "what is", "what's", "who is", "current", "latest",
                            "news", "today", "now", "recent", "weather", "forecast", "temperature",
                            "tomorrow", "how to", "when is", "where is"]
@@ -1725,28 +3763,40 @@ else:
 
         # Check for URLs in the prompt
         urls_found = re.findall(url_pattern, prompt)
-        if urls_found:
-            with st.spinner("🌐 Fetching webpage content..."):
-                for url in urls_found:
-                    webpage_content = fetch_webpage(url)
-                    web_context += f"\n\n[Content from {url}]:\n{webpage_content}\n"
+        should_search = False
+        probe_search = False
 
         # Check if user wants to search
-        elif any(keyword in prompt.lower() for keyword in search_keywords):
-            with st.spinner("🔍 Searching the web..."):
-                search_results = web_search(prompt, num_results=5)
-                if search_results and len(search_results) > 0:
-                    web_context = "\n\n[Web Search Results]:\n"
-                    for i, result in enumerate(search_results):
-                        if "error" not in result:
-                            web_context += f"{i+1}. {result['title']}\n"
-                            web_context += f"   {result['snippet']}\n"
-                            web_context += f"   URL: {result['link']}\n\n"
-
-                    if not web_context.strip().endswith("URL:"):
-                        st.info(f"🔍 Found {len(search_results)} search results")
-                else:
-                    web_context = "\n\n[Web search was attempted but no results were found]"
+        if not urls_found:
+            should_search, intent_score, intent_matches = classify_search_intent(prompt, st.session_state.language)
+            intent_stats = get_search_intent_stats()
+            keyword_match = any(keyword in prompt.lower() for keyword in search_keywords)
+            if should_search:
+                intent_stats["searched"] += 1
+            else:
+                intent_stats["skipped"] += 1
+                intent_stats["skipped_keyword_match"] += keyword_match
+            print(f"Search intent: {'search' if should_search else 'skip'} score={intent_score:g} "
+                  f"matches={intent_matches} keyword_match={keyword_match}")
+            # Borderline prompts search speculatively while the model is asked whether it's needed
+            probe_search = (WEB_LOOKUP_MODE == "pipelined" and SEARCH_PROBE and not should_search
+                            and intent_score >= SEARCH_PROBE_MIN_SCORE)
+
+        lookup_future = None
+        probe_future = None
+        lookup_started = time.perf_counter()
+        search_result_count = 0
+        if WEB_LOOKUP_MODE == "pipelined" and (urls_found or should_search or probe_search):
+            # Start the lookup now and assemble the prompt while it runs
+            lookup_future = get_lookup_executor().submit(lookup_web_context, prompt, urls_found, True)
+            if probe_search:
+                probe_future = get_lookup_executor().submit(probe_search_needed, get_search_probe_model(SEARCH_PROBE_MODEL), prompt)
+        elif urls_found or should_search:
+            with st.spinner("🌐 Fetching webpage content..." if urls_found else "🔍 Searching the web..."):
+                web_context, search_result_count = lookup_web_context(prompt, urls_found, should_search)
+            if search_result_count:
+                st.info(f"🔍 Found {search_result_count} search results")
+        web_wait_ms = (time.perf_counter() - lookup_started) * 1000
 
         # Display assistant reply
         avatar = st.session_state.ai_avatar if st.session_state.ai_avatar is not None else None
@@ -1755,73 +3805,38 @@ else:
             full_response = ""
 
             try:
-                # Build message list with personality and language settings
-                internet_note = "You have access to the internet. When users ask about current events, recent information, or provide URLs, use the web search results or webpage content provided in the context."
-                image_analysis_note = "\n\nENHANCED IMAGE ANALYSIS: When you receive [IMAGE ANALYSIS START]...[IMAGE ANALYSIS END] sections, you're getting a 32x32 pixel grid (1024 pixels total) in hexadecimal RGB format. Each pixel is 6 hex characters (RRGGBB). The data includes: 1) Full pixel grid in hex format, 2) Color analysis (average color, dominant tones, brightness), 3) Edge detection data showing object boundaries and locations. Use ALL this data together to accurately identify objects, people, animals, text, scenes, and content. The 32x32 resolution with hex encoding provides good detail while staying token-efficient. Edge detection helps you locate and identify distinct objects in the image."
-                system_message = {
-                    "role": "system",
-                    "content": f"{job_prompts[st.session_state.job]} {personality_prompts[st.session_state.personality]} {language_instructions[st.session_state.language]} {internet_note}{image_analysis_note}"
-                }
-
-                # Convert messages to API format with vision support
-                # OPTIMIZATION: Only send last 10 messages to save tokens
-                recent_messages = st.session_state.messages[-10:] if len(st.session_state.messages) > 10 else st.session_state.messages
-
-                api_messages = [system_message]
-                has_images = False
-                image_files = []  # Store actual image files for Gemini
-
-                for i, m in enumerate(recent_messages):
-                    content = m["content"]
-                    if isinstance(content, dict):
-                        # Check if this message has images - handle both list and empty list cases
-                        images_list = content.get("images", [])
-                        # Filter out None or empty objects
-                        valid_images = [img for img in images_list if img is not None]
-
-                        if valid_images and len(valid_images) > 0:
-                            # Convert images to compact text representation for Groq
-                            text = content.get("text", "")
-
-                            # Add each image as text data (now much smaller with 20x20)
-                            for idx, img_file in enumerate(valid_images):
-                                image_text = image_to_text_representation(img_file)
-                                text += f"\n\n--- IMAGE {idx + 1} ---\n{image_text}\n"
-
-                            # Add web context to the last user message
-                            if i == len(recent_messages) - 1 and m["role"] == "user" and web_context:
-                                text += web_context
-
-                            api_messages.append({"role": m["role"], "content": text})
+                # Model with the personality and language settings as its system instruction
+                chat_model = get_gemini_client(st.session_state.job, st.session_state.personality, st.session_state.language)
+
+                # OPTIMIZATION: Send as much recent history as fits the token budget,
+                # older turns are folded into a running summary
+                recent_messages, history_summary = get_context_window(get_gemini_client(), st.session_state.messages, CONTEXT_TOKEN_BUDGET)
+
+                # Pipelined mode: collect the web lookup started before the prompt was assembled
+                if lookup_future:
+                    wait_started = time.perf_counter()
+                    with st.spinner("🌐 Fetching webpage content..." if urls_found else "🔍 Searching the web..."):
+                        search_needed = probe_future.result() if probe_future else True
+                        if search_needed is False:
+                            # Not needed after all - drop the search (it still fills the cache if already running)
+                            lookup_future.cancel()
+                            get_search_intent_stats()["probe_skipped"] += 1
+                            print("Search probe: not needed, speculative search discarded")
                         else:
-                            # Text only
-                            text = content.get("text", "")
-                            if i == len(recent_messages) - 1 and m["role"] == "user" and web_context:
-                                text += web_context
-                            api_messages.append({"role": m["role"], "content": text})
-                    else:
-                        message_text = content
-                        # Add web context to the last user message
-                        if i == len(recent_messages) - 1 and m["role"] == "user" and web_context:
-                            message_text += web_context
-                        api_messages.append({"role": m["role"], "content": message_text})
-
-                messages_with_personality = api_messages
-
-                # Use Gemini API for all requests (images are converted to 32x32 pixel text with edge detection)
-                # Build conversation prompt for Gemini
-                conversation_text = ""
-                for msg in messages_with_personality:
-                    if msg["role"] == "system":
-                        conversation_text += msg["content"] + "\n\n"
-                    elif msg["role"] == "user":
-                        conversation_text += "User: " + msg["content"] + "\n\n"
-                    elif msg["role"] == "assistant":
-                        conversation_text += "Assistant: " + msg["content"] + "\n\n"
+                            web_context, search_result_count = lookup_future.result()
+                            if probe_future:
+                                get_search_intent_stats()["probe_failed" if search_needed is None else "probe_searched"] += 1
+                    web_wait_ms = (time.perf_counter() - wait_started) * 1000
+                    if search_result_count:
+                        st.info(f"🔍 Found {search_result_count} search results")
+
+                # Build multi-turn contents for Gemini - each message is rendered once and
+                # reused on later turns, only the web context is added fresh
+                conversation_contents = build_conversation_contents(recent_messages, web_context, history_summary)
 
                 # Call Gemini API with streaming
-                response = client.generate_content(
-                    conversation_text,
+                response = chat_model.generate_content(
+                    conversation_contents,
                     stream=True,
                     generation_config={
                         'max_output_tokens': 2048,
@@ -1829,21 +3844,22 @@ else:
                     }
                 )
 
-                # Stream output response
+                # Stream output response (throttled so long answers don't flood the frontend)
+                renderer = StreamingRenderer(message_placeholder)
                 try:
                     for chunk in response:
                         if hasattr(chunk, 'text') and chunk.text:
-                            full_response += chunk.text
-                            message_placeholder.markdown(full_response + "▌")
+                            renderer.add(chunk.text)
                 except Exception as stream_error:
                     # Check if it's a safety block or other error
                     if "block" in str(stream_error).lower():
-                        full_response += "\n\n[Response was blocked by safety filters]"
+                        renderer.parts.append("\n\n[Response was blocked by safety filters]")
                     else:
-                        full_response += f"\n\n[Streaming error: {str(stream_error)}]"
+                        renderer.parts.append(f"\n\n[Streaming error: {str(stream_error)}]")
 
                 # Display full response
-                message_placeholder.markdown(full_response)
+                full_response = renderer.finish()
+                st.session_state.stream_stats = {**renderer.stats(), "web_wait_ms": web_wait_ms}
 
             except Exception as e:
                 import traceback
@@ -1858,6 +3874,11 @@ else:
             # Clear uploaded images after sending to prevent accidental reuse
             st.session_state.uploaded_images = []
 
+        # Speak the new response right away, starting with its first sentences
+        if st.session_state.auto_play_tts and polly_client:
+            st.session_state.tts_autoplayed = len(st.session_state.messages) - 1
+            play_tts_early(full_response)
+
     # Sidebar
     with st.sidebar:
         st.header(t["settings"])
@@ -1932,8 +3953,7 @@ else:
                     img = background
                 buffer = BytesIO()
                 img.save(buffer, format='JPEG', quality=85, optimize=True)
-                buffer.seek(0)
-                st.session_state.profile_photo = buffer
+                st.session_state.profile_photo = buffer.getvalue()
                 st.rerun()
         if st.button(t["signout_button"], use_container_width=True, key="signout_btn"):
             # Clear all session state
@@ -2058,8 +4078,7 @@ else:
                     img = background
                 buffer = BytesIO()
                 img.save(buffer, format='JPEG', quality=85, optimize=True)
-                buffer.seek(0)
-                st.session_state.ai_avatar = buffer
+                st.session_state.ai_avatar = buffer.getvalue()
                 st.rerun()
 
         # Preview AI avatar in a nice display
@@ -2208,8 +4227,6 @@ else:
             # Update session state if voice changed
             if POLLY_VOICES[selected_voice] != st.session_state.selected_voice:
                 st.session_state.selected_voice = POLLY_VOICES[selected_voice]
-                # Clear TTS cache when voice changes
-                st.session_state.tts_audio = {}
                 st.success(f"Voice changed to {selected_voice}")
 
         st.divider()
@@ -2246,6 +4263,8 @@ else:
         # Clear chat history button
         if st.button(t["clear_chat"]):
             st.session_state.messages = []
+            st.session_state.context_summary = {"text": "", "covered": 0}
+            st.session_state.pop("history_window", None)
             st.rerun()
 
         st.divider()
@@ -2257,6 +4276,48 @@ else:
         st.write(f"**{t['personality']}**: {personality_icons[st.session_state.personality]} {personality_names[st.session_state.personality]}")
         st.write(f"**{t['messages']}**: {len(st.session_state.messages)}")
 
+        # Performance stats
+        with st.expander("📊 Performance"):
+            if st.session_state.stream_stats:
+                stream_stats = st.session_state.stream_stats
+                st.write(
+                    f"**Last response**: {stream_stats['chunks_received']} chunks, {stream_stats['renders_issued']} renders, "
+                    f"{stream_stats['web_wait_ms']:.0f} ms waiting for web context"
+                )
+            else:
+                st.caption("No responses yet")
+            attachment_usage = attachment_session_usage(st.session_state.messages)
+            st.write(
+                f"**Attachments**: {(attachment_usage['thumbnails'] + attachment_usage['avatars']) / 1024:.0f} KB thumbnails/avatars, "
+                f"{attachment_usage['cached'] / (1024 * 1024):.1f} MB cached in session ({attachment_usage['spills']} spilled to disk)"
+            )
+            tts_stats = get_tts_cache().stats()
+            for label, namespace in (("Search cache", "search"), ("Page cache", "page")):
+                cache_stats = get_web_cache(namespace).stats()
+                st.write(
+                    f"**{label}**: {cache_stats['memory_hits']} memory / {cache_stats['store_hits']} disk / "
+                    f"{cache_stats['stale_hits']} stale hits, {cache_stats['misses']} misses ({cache_stats['hit_ratio']:.0%}), "
+                    f"{cache_stats['upstream_calls']} upstream calls, {cache_stats['coalesced']} coalesced"
+                )
+            intent_stats = get_search_intent_stats()
+            st.write(
+                f"**Search intent**: {intent_stats['searched']} searched, {intent_stats['skipped']} skipped "
+                f"({intent_stats['skipped_keyword_match']} the old keyword match would have searched), "
+                f"probe: {intent_stats['probe_searched']} searched / {intent_stats['probe_skipped']} discarded / "
+                f"{intent_stats['probe_failed']} failed"
+            )
+            page_stats = get_page_cache_stats()
+            st.write(f"**Pages**: {page_stats['fetched']} downloaded, {page_stats['revalidated']} revalidated (304)")
+            retrieval_stats = get_retrieval_stats()
+            if retrieval_stats["selections"]:
+                st.write(
+                    f"**Web context**: kept {retrieval_stats['chunks_kept']} of {retrieval_stats['chunks_seen']} chunks "
+                    f"over {retrieval_stats['selections']} lookups (~{retrieval_stats['tokens_kept'] // retrieval_stats['selections']} tokens each)"
+                )
+            http_stats = get_http_client().stats()
+            st.write(f"**HTTP**: {http_stats['requests']} requests over {http_stats['connections']} connections ({http_stats['reused']} reused, {http_stats['hosts']} hosts)")
+            st.write(f"**TTS cache**: {tts_stats['hits']} hits / {tts_stats['misses']} misses ({tts_stats['hit_ratio']:.0%}), {tts_stats['bytes'] / (1024 * 1024):.1f} MB")
+
 
     # Help dialog - must be defined outside sidebar
     if st.session_state.show_help:
@@ -0,0 +1,42 @@
+"""Rerun time of the chat page against conversation length (user-025).
+
+Reruns a signed-in chat page holding n messages and reports the median rerun and
+the number of chat messages rendered. Pass a git revision to measure app.py at that
+revision, e.g. the commit before user-025 for the baseline.
+
+    python benchmarks/bench_chat_history.py [REVISION]
+"""
+import sys
+import tempfile
+import time
+
+from harness import APP_PATH, app_test, checkout_app, median
+
+RERUNS = 5
+
+
+def conversation(n):
+    messages = []
+    for i in range(n):
+        if i % 2 == 0:
+            messages.append({"role": "user", "content": f"question {i} " + "words " * 30})
+        else:
+            code = "\n```python\nprint(1)\n```\n" if i % 6 == 1 else ""
+            messages.append({"role": "assistant", "content": f"answer {i}\n\n" + "Some **markdown** text. " * 40 + code})
+    return messages
+
+
+app_path = APP_PATH
+if len(sys.argv) > 1:
+    app_path = checkout_app(sys.argv[1], tempfile.mkdtemp(prefix="bench-chat-history-"))
+
+for n in (10, 50, 200, 500):
+    at = app_test(app_path, messages=conversation(n))
+    at.run()
+    timings = []
+    for _ in range(RERUNS):
+        started = time.perf_counter()
+        at.run()
+        timings.append(time.perf_counter() - started)
+    assert not at.exception, at.exception
+    print(f"{n:4d} messages: rerun {median(timings) * 1000:5.0f} ms, chat messages rendered {len(at.chat_message)}")
@@ -0,0 +1,37 @@
+"""Batch image generation throughput against a local stand-in inference server (user-020).
+
+Eight images go through app.py's ImageJobQueue and generate_image_png, using the
+real InferenceClient over HTTP against a server that takes INFERENCE_DELAY per image,
+at different worker counts (IMAGE_MAX_CONCURRENT).
+
+    python benchmarks/bench_image_throughput.py
+"""
+import time
+from functools import partial
+
+from huggingface_hub import InferenceClient
+
+from harness import load_app_functions
+from stub_servers import start_inference_server
+
+IMAGES = 8
+INFERENCE_DELAY = 1.0
+
+# The client talks to the stub server directly, so no model name is sent
+app = load_app_functions(
+    {"ImageGenerationParams", "generate_image_png", "ImageJobQueue"},
+    IMAGE_MODEL=None, IMAGE_MODEL_SETTINGS={}, IMAGE_JOB_RETENTION_SECONDS=3600
+)
+client = InferenceClient(base_url=start_inference_server(INFERENCE_DELAY), token="benchmark")
+
+for workers in (1, 2, 4, 8):
+    queue = app["ImageJobQueue"](workers, IMAGES)
+    started = time.perf_counter()
+    for i in range(IMAGES):
+        params = app["ImageGenerationParams"](f"benchmark prompt {i}", 512, 512, seed=i)
+        queue.submit("benchmark", partial(app["generate_image_png"], client, params))
+    while any(job["status"] in ("queued", "running") for job in queue.session_jobs("benchmark")):
+        time.sleep(0.02)
+    elapsed = time.perf_counter() - started
+    done = [job for job in queue.collect_finished("benchmark") if job["status"] == "done"]
+    print(f"concurrency {workers}: {len(done)}/{IMAGES} images in {elapsed:.2f} s -> {len(done) / elapsed:.2f} images/s")
@@ -0,0 +1,100 @@
+"""Per-turn prompt assembly cost against history length (user-003).
+
+Compares build_conversation_contents() from app.py with the inline assembly the chat
+used before, which re-rendered every message in the window (pixel-grid text for
+images) and built the prompt with repeated string +=. Both run in the text image
+mode with a 10-message window and web context on the last user message.
+
+    python benchmarks/bench_prompt_assembly.py
+"""
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from harness import load_app_functions
+
+WINDOW = 10
+ROUNDS = 50
+
+app = load_app_functions(
+    {"IMAGE_GRID_SIZE", "IMAGE_ANALYSIS_INSTRUCTIONS", "analyze_image_bytes", "image_to_text_representation",
+     "MemoryLRUCache", "get_encoded_attachment_cache", "ATTACHMENT_ENCODED_MAX_ENTRIES", "GEMINI_IMAGE_MAX_SIZE",
+     "GEMINI_IMAGE_QUALITY", "attachment_prompt_part", "merge_text_parts", "render_prompt_fragment",
+     "get_prompt_fragment", "build_conversation_contents"},
+    IMAGE_INPUT_MODE="text"
+)
+attachments = {}
+app["load_attachment"] = lambda ref: attachments[ref["attachment"]]
+
+
+def legacy_assemble(system_content, recent_messages, web_context):
+    """The chat's assembly before user-003 (images as file objects)"""
+    image_to_text_representation = app["image_to_text_representation"]
+    api_messages = [{"role": "system", "content": system_content}]
+    for i, m in enumerate(recent_messages):
+        content = m["content"]
+        if isinstance(content, dict):
+            valid_images = [img for img in content.get("images", []) if img is not None]
+            text = content.get("text", "")
+            for idx, img_file in enumerate(valid_images):
+                text += f"\n\n--- IMAGE {idx + 1} ---\n{image_to_text_representation(img_file)}\n"
+            if i == len(recent_messages) - 1 and m["role"] == "user" and web_context:
+                text += web_context
+            api_messages.append({"role": m["role"], "content": text})
+        else:
+            message_text = content
+            if i == len(recent_messages) - 1 and m["role"] == "user" and web_context:
+                message_text += web_context
+            api_messages.append({"role": m["role"], "content": message_text})
+
+    conversation_text = ""
+    for msg in api_messages:
+        if msg["role"] == "system":
+            conversation_text += msg["content"] + "\n\n"
+        elif msg["role"] == "user":
+            conversation_text += "User: " + msg["content"] + "\n\n"
+        elif msg["role"] == "assistant":
+            conversation_text += "Assistant: " + msg["content"] + "\n\n"
+    return conversation_text
+
+
+def photo(seed):
+    pixels = np.random.default_rng(seed).integers(0, 255, (50, 80, 3), dtype=np.uint8)
+    buf = BytesIO()
+    Image.fromarray(pixels).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def history(n, legacy):
+    """n alternating turns, every other user turn with an image attached"""
+    messages = []
+    for k in range(n):
+        if k % 2:
+            messages.append({"role": "assistant", "content": "answer " * 200})
+        elif k % 4 == 0:
+            data = photo(k)
+            if legacy:
+                image = BytesIO(data)
+            else:
+                attachments[str(k)] = data
+                image = {"attachment": str(k), "thumbnail": None}
+            messages.append({"role": "user", "content": {"text": "hi " * 50, "images": [image]}})
+        else:
+            messages.append({"role": "user", "content": "question " * 50})
+    return messages
+
+
+def per_turn_us(assemble, messages):
+    assemble(messages[-WINDOW:])
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        assemble(messages[-WINDOW:])
+    return (time.perf_counter() - started) / ROUNDS * 1e6
+
+
+for n in (10, 100, 1000):
+    legacy = per_turn_us(lambda window: legacy_assemble("SYS", window, "\n\n[Web]: results"), history(n, legacy=True))
+    current = per_turn_us(lambda window: app["build_conversation_contents"](window, "\n\n[Web]: results"), history(n, legacy=False))
+    print(f"{n:5d} messages: legacy {legacy:7.0f} us, current {current:7.0f} us per turn")
@@ -0,0 +1,46 @@
+"""First script run in a fresh process, and which backend SDKs it imports (user-009).
+
+Each page is measured in its own subprocess so module imports are not shared.
+Pass a git revision to measure app.py at that revision instead of the working tree,
+e.g. the commit before user-009 for the baseline.
+
+    python benchmarks/bench_startup.py [REVISION]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from harness import APP_PATH, app_test, checkout_app
+
+HEAVY_MODULES = ("boto3", "google.generativeai", "huggingface_hub", "speech_recognition", "bs4", "audio_recorder_streamlit")
+
+
+def measure(page, app_path):
+    """Run in the child process: time the first and second script run of one page"""
+    # No Gemini stub - installing it would import google.generativeai up front
+    at = app_test(app_path, stub_gemini=False)
+    if page == "sign-in":
+        at.session_state["signed_in"] = False
+    started = time.perf_counter()
+    at.run()
+    first = time.perf_counter() - started
+    started = time.perf_counter()
+    at.run()
+    second = time.perf_counter() - started
+    heavy = [name for name in HEAVY_MODULES if name in sys.modules]
+    print(f"{page:8s}: first run {first * 1000:5.0f} ms, rerun {second * 1000:4.0f} ms, SDKs imported: {heavy or 'none'}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--child":
+        measure(sys.argv[2], sys.argv[3])
+        sys.exit()
+
+    app_path = APP_PATH
+    if len(sys.argv) > 1:
+        app_path = checkout_app(sys.argv[1], tempfile.mkdtemp(prefix="bench-startup-"))
+    for page in ("sign-in", "chat"):
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--child", page, app_path], check=True,
+                       stderr=subprocess.DEVNULL)
@@ -0,0 +1,86 @@
+"""Time from sending a prompt to the generate_content call, serial vs pipelined web lookup (user-018).
+
+DuckDuckGo is replaced by a stub transport that answers after SEARCH_DELAY, and the
+Gemini stub takes SUMMARY_DELAY for the history summary and PROBE_DELAY for the
+search probe. The history is long enough that every turn refreshes the summary,
+and each run uses a new query so the web cache never answers.
+
+    python benchmarks/bench_web_lookup.py
+"""
+import os
+import tempfile
+import time
+import types
+
+import requests.adapters
+
+from harness import StubChunk, StubModel, app_test, median
+
+SEARCH_DELAY, SUMMARY_DELAY, PROBE_DELAY = 1.5, 0.8, 0.4
+RUNS = 3
+
+os.environ["CACHE_DIR"] = tempfile.mkdtemp(prefix="bench-web-lookup-")
+os.environ["CONTEXT_TOKEN_BUDGET"] = "300"
+
+SEARCH_PAGE = (
+    "<div class='result'><a class='result__a' href='http://example.com'>Weather Paris</a>"
+    "<a class='result__snippet'>Sunny 20C today</a></div>" * 5
+).encode()
+
+
+def send_search(self, request, **kwargs):
+    time.sleep(SEARCH_DELAY)
+    response = requests.models.Response()
+    response.status_code = 200
+    response.url = request.url
+    response.headers["Content-Type"] = "text/html; charset=utf-8"
+    response._content = SEARCH_PAGE
+    return response
+
+
+requests.adapters.HTTPAdapter.send = send_search
+
+probe_answer = "NO"
+generate_started = []
+
+
+def respond(model, contents, stream):
+    if stream:
+        generate_started.append(time.perf_counter())
+        return iter([StubChunk("ok")])
+    if "YES or NO" in contents:
+        time.sleep(PROBE_DELAY)
+        return types.SimpleNamespace(text=probe_answer)
+    time.sleep(SUMMARY_DELAY)
+    return types.SimpleNamespace(text="summary")
+
+
+StubModel.respond = respond
+
+history = [
+    {"role": role, "content": "long message about gardening " * 40 if role == "user" else "reply " * 200}
+    for role in ["user", "assistant"] * 3
+]
+scenarios = [
+    ("serial", "false", "NO"),
+    ("pipelined", "false", "NO"),
+    ("pipelined", "true", "NO"),
+    ("pipelined", "true", "YES")
+]
+run_id = 0
+for prompt in ("what's the weather in Paris today?", "what is the capital of Peru"):
+    for mode, probe, probe_answer in scenarios:
+        os.environ["WEB_LOOKUP_MODE"] = mode
+        os.environ["SEARCH_PROBE"] = probe
+        timings = []
+        for _ in range(RUNS):
+            run_id += 1
+            at = app_test(messages=[dict(message) for message in history])
+            at.run()
+            started = time.perf_counter()
+            at.chat_input[0].set_value(f"{prompt} #{run_id}").run()
+            assert not at.exception, at.exception
+            timings.append(generate_started[-1] - started)
+        has_web = "Web Search Results" in str(StubModel.calls[-1][1])
+        label = f"{mode}{f' probe {probe_answer}' if probe == 'true' else ''}"
+        print(f"{prompt!r:38s} {label:22s} {median(timings):.2f} s to generate_content, web context: {has_web}")
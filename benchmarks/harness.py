@@ -0,0 +1,97 @@
+"""Shared helpers for the benchmark scripts.
+
+load_app_functions() pulls selected top-level definitions out of app.py (or app.py
+at a git revision) without running the page. app_test() drives the whole app with
+Streamlit's AppTest, signed in, against StubModel instead of the Gemini API.
+"""
+import ast
+import os
+import subprocess
+import types
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_DIR, "app.py")
+
+
+def app_source(revision=None):
+    """app.py from the working tree, or from a git revision"""
+    if revision is None:
+        with open(APP_PATH, encoding="utf-8") as f:
+            return f.read()
+    return subprocess.check_output(["git", "-C", REPO_DIR, "show", f"{revision}:app.py"], text=True)
+
+
+def load_app_functions(names, revision=None, **overrides):
+    """Run app.py's imports and the named top-level definitions in a fresh namespace"""
+    tree = ast.parse(app_source(revision))
+    namespace = {}
+    imports = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+    exec(compile(ast.Module(imports, []), APP_PATH, "exec"), namespace)
+    for node in tree.body:
+        name = getattr(node, "name", None)
+        if isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+        if name in names:
+            exec(compile(ast.Module([node], []), APP_PATH, "exec"), namespace)
+    namespace.update(overrides)
+    return namespace
+
+
+class StubChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubModel:
+    """Stands in for genai.GenerativeModel. Every call is recorded in StubModel.calls;
+    replace StubModel.respond to change replies or add latency"""
+    calls = []
+
+    def __init__(self, model_name, **kwargs):
+        self.model_name = model_name
+        self.kwargs = kwargs
+
+    @staticmethod
+    def respond(model, contents, stream):
+        if stream:
+            return iter([StubChunk("Hello "), StubChunk("world. " * 3)])
+        return types.SimpleNamespace(text="summary text")
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        StubModel.calls.append((self.model_name, contents))
+        return StubModel.respond(self, contents, stream)
+
+
+def install_stub_gemini():
+    import google.generativeai as genai
+
+    genai.GenerativeModel = StubModel
+    genai.configure = lambda **kwargs: None
+
+
+def app_test(app_path=APP_PATH, stub_gemini=True, **state):
+    """AppTest for a signed-in session with the given session state"""
+    from streamlit.testing.v1 import AppTest
+
+    if stub_gemini:
+        install_stub_gemini()
+    at = AppTest.from_file(app_path, default_timeout=120)
+    at.session_state["signed_in"] = True
+    at.session_state["user_name"] = "Benchmark"
+    for key, value in state.items():
+        at.session_state[key] = value
+    return at
+
+
+def checkout_app(revision, directory):
+    """Write app.py at a git revision to directory/app.py and return its path"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "app.py")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(app_source(revision))
+    return path
+
+
+def median(values):
+    return sorted(values)[len(values) // 2]
+
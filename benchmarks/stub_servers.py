@@ -0,0 +1,38 @@
+"""Local HTTP servers that stand in for remote backends in the benchmarks."""
+import http.server
+import threading
+import time
+from io import BytesIO
+
+from PIL import Image
+
+
+class InferenceHandler(http.server.BaseHTTPRequestHandler):
+    """Answers every text-to-image POST with a PNG after `delay` seconds"""
+    protocol_version = "HTTP/1.1"
+    delay = 1.0
+    requests_served = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.delay)
+        buf = BytesIO()
+        Image.new("RGB", (256, 256), (20, 120, 200)).save(buf, format="PNG")
+        body = buf.getvalue()
+        InferenceHandler.requests_served += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_inference_server(delay=1.0):
+    """Start the stand-in inference server on a free port and return its base URL"""
+    InferenceHandler.delay = delay
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), InferenceHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
@@ -0,0 +1,81 @@
+"""Main content extraction from fetched pages (PageTextCollector / extract_main_content)."""
+import ast
+import os
+
+import pytest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+NAMES = {"PageTextCollector", "_StdlibHTMLFeeder", "parse_html_stream", "score_text_block", "extract_main_content"}
+
+
+@pytest.fixture(scope="module")
+def app():
+    """app.py's imports and page extraction code, without running the page"""
+    with open(APP_PATH, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    namespace = {}
+    nodes = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom)) or getattr(node, "name", None) in NAMES]
+    exec(compile(ast.Module(nodes, []), APP_PATH, "exec"), namespace)
+    namespace.update(PAGE_TEXT_LIMIT=5000, PAGE_MAX_PASSAGES=5)
+    return namespace
+
+
+ARTICLE = (
+    "<article><h1>Tide pools</h1>"
+    "<p>Tide pools form where the sea leaves water behind on rocky shores, and they hold anemones, crabs and snails.</p>"
+    "<p>Visitors should step only on bare rock, since the animals living there are easily crushed, and turn stones back over.</p>"
+    "</article>"
+)
+NAV = "<nav><a href='/'>Home</a> <a href='/one'>Section one</a> <a href='/two'>Section two</a></nav>"
+FOOTER = "<footer>Copyright 2024 Example Publishing, all rights reserved.</footer>"
+
+
+def extract(app, body_open, body_close, parser):
+    html = f"<html><head><title>Shore guide</title></head>{body_open}{NAV}{ARTICLE}{FOOTER}{body_close}</html>"
+    collector = app["PageTextCollector"]()
+    if parser == "stdlib":
+        feeder = app["_StdlibHTMLFeeder"](collector)
+        feeder.feed(html)
+        feeder.close()
+    else:
+        app["parse_html_stream"]([html.encode()], "utf-8", collector)
+    return app["extract_main_content"](collector.close())
+
+
+@pytest.mark.parametrize("body_open, body_close", [
+    ("<body>", "</body>"),
+    ('<body class="single has-sidebar">', "</body>"),
+    ('<body class="home navbar-fixed">', "</body>"),
+    ('<body><div class="shared-layout">', "</div></body>"),
+    ('<body><main id="main-content" class="with-sidebar">', "</main></body>"),
+])
+@pytest.mark.parametrize("parser", ["default", "stdlib"])
+def test_layout_classes_do_not_hide_the_article(app, body_open, body_close, parser):
+    text = extract(app, body_open, body_close, parser)
+    assert "Tide pools form where the sea leaves water behind" in text
+    assert "Section one" not in text
+    assert "Copyright 2024" not in text
+
+
+def test_boilerplate_classes_match_whole_words_only(app):
+    collector = app["PageTextCollector"]()
+    for class_name, expected in [("shared-layout", False), ("navigation", True), ("site_footer", True),
+                                 ("canvas", False), ("related-posts", True)]:
+        collector.start("div", {"class": class_name})
+        collector.data("Some text inside the element that is long enough.")
+        collector.end("div")
+        assert collector.blocks[-1]["boilerplate"] is expected, class_name
+
+
+def test_nearest_landmark_decides(app):
+    collector = app["PageTextCollector"]()
+    collector.start("main", {})
+    collector.start("div", {"class": "sidebar"})
+    collector.data("Popular posts this week")
+    collector.start("article", {})
+    collector.data("An article nested in a sidebar wrapper.")
+    collector.end("article")
+    collector.end("div")
+    collector.end("main")
+    collector.close()
+    assert [block["boilerplate"] for block in collector.blocks] == [True, False]